@@ -30,8 +30,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "core.subdomain_middleware.SubdomainMiddleware",
-    'core.subdomain_middleware.SubdomainURLRoutingMiddleware',
+    'core.subdomain_middleware.HostResolverMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'core.middleware.VisitorTrackingMiddleware',
@@ -69,7 +68,48 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Visitor tracking + rollups (see core/db_routers.py).
+    # Migrate with: python manage.py migrate --database=analytics
+    'analytics': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'analytics.sqlite3',
+    },
+    # Shared cache tables (see CACHES below).
+    # Create with: python manage.py createcachetable --database=cache
+    'cache': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'cache.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['core.db_routers.AnalyticsRouter', 'core.db_routers.CacheRouter']
+
+
+# Cache
+# "default" (storefront fragments, facets) and "stores" (store lookups,
+# content versions and the custom domain index version, from which fragment
+# keys and ETags are built) must be shared by every worker process: a
+# per-process cache never sees another worker's invalidations. Both are
+# tables in the "cache" database (core.db_routers); "stores" is kept apart
+# so that culling fragments never drops a version. "local" is per process,
+# for high-volume keys that only save repeated work (visitor dedupe, remote
+# GeoIP lookups). Use Redis or Memcached once there is more than one host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'stores': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_store_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
 }
 
 
@@ -117,3 +157,88 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 LOGIN_URL = "login"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+
+# Uploads and derivatives are stored under their content hash (core/storage.py):
+# identical files are kept once and their URLs can be cached as immutable.
+STORAGES = {
+    "default": {"BACKEND": "core.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# Visitor tracking
+# "buffered" queues visits in-process and bulk inserts them from a background
+# thread; "sync" writes each visit on the request thread.
+VISITOR_LOG_MODE = "buffered"
+VISITOR_LOG_BATCH_SIZE = 200        # rows per bulk_create
+VISITOR_LOG_FLUSH_INTERVAL = 2.0    # seconds between flushes
+VISITOR_LOG_MAX_QUEUE = 10000       # visits held in memory before dropping
+
+# Storefront likes (core/likes.py): "sync" toggles each like in its own short
+# transaction; "buffered" coalesces toggles in memory and writes them in
+# batches, answering with an optimistic count (for like storms).
+LIKE_WRITE_MODE = "sync"
+LIKE_BATCH_SIZE = 500
+LIKE_FLUSH_INTERVAL = 0.3
+LIKE_MAX_QUEUE = 10000
+
+# Related-products index (core/related.py): "buffered" recomputes the products
+# an edit affects from a background thread, coalescing repeated ids; "sync"
+# recomputes them on the request thread once the edit commits.
+RELATED_REFRESH_MODE = "buffered"
+RELATED_REFRESH_BATCH_SIZE = 200    # product ids per background pass
+RELATED_REFRESH_FLUSH_INTERVAL = 1.0
+RELATED_REFRESH_MAX_QUEUE = 50000   # ids held in memory before dropping (rebuild_related_products repairs)
+
+# Product image derivatives (large/medium/thumb): "queued" stores the upload
+# and leaves resizing to `manage.py process_image_jobs` (core/image_jobs.py);
+# "sync" resizes on the request thread.
+IMAGE_DERIVATIVE_MODE = "queued"
+IMAGE_JOB_WORKERS = None            # worker processes (None = one per CPU)
+IMAGE_JOB_MAX_ATTEMPTS = 3
+IMAGE_JOB_TIMEOUT = 600             # seconds before a "running" job is assumed dead and retried
+# Cache-Control max-age of the format-negotiating product image view (Vary: Accept)
+PRODUCT_IMAGE_MAX_AGE = 86400
+# On-demand resizing (core/image_cache.py): signed /resize/ URLs for these widths
+# only, results kept in a disk LRU bounded to IMAGE_RESIZE_CACHE_MAX_BYTES
+IMAGE_RESIZE_WIDTHS = [160, 320, 480, 640, 960, 1200, 1600]
+IMAGE_RESIZE_CACHE_DIR = BASE_DIR / "image_cache"
+IMAGE_RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# How anonymous visitors are identified (no session is created for them):
+# "cookie" sets a signed visitor-ID cookie, "hash" uses a keyed hash of IP + user agent.
+VISITOR_ID_MODE = "cookie"
+# Raw Visitor rows are deleted by `manage.py rollup_visitors` once rolled up and
+# older than this many days.
+VISITOR_RETENTION_DAYS = 90
+VISITOR_PURGE_BATCH_SIZE = 5000
+# Per-process LRU size (per lookup table) for interned user agents, paths, referrers, locations
+VISITOR_INTERN_CACHE_SIZE = 5000
+
+# Geolocation for visitor tracking
+# "local" resolves from the offline range database built by `manage.py import_geoip`;
+# "ip-api" calls ip-api.com on the request thread.
+GEOIP_BACKEND = "local"
+GEOIP_DATABASE = BASE_DIR / "geoip" / "ranges.dat"
+
+# Host resolution (core/subdomain_middleware.py)
+# <subdomain>.<base domain> serves that store; the bare base domains serve the main site.
+# Stores may also be reached on their Store.custom_domain.
+STOREFRONT_BASE_DOMAINS = ["bazaa.digital", "localhost"]
+RESERVED_SUBDOMAINS = ["www"]
+
+# Subdomain → Store resolution cache (core/store_cache.py)
+STORE_CACHE_TTL = 300            # shared cache, found stores
+STORE_CACHE_NEGATIVE_TTL = 60    # shared cache, unknown subdomains
+STORE_CACHE_LOCAL_TTL = 30       # per-process LRU
+STORE_CACHE_LOCAL_SIZE = 1024
+# custom domain index: reloaded at least this often, version bump or not
+STORE_DOMAIN_INDEX_MAX_AGE = 300
+
+# Storefront HTML fragment cache; keys carry the store's content version,
+# so this only bounds how long unused fragments linger
+STOREFRONT_FRAGMENT_TTL = 3600
+# Cache-Control max-age on storefront HTML (shared by all visitors; like
+# state comes from the liked-products endpoint)
+STOREFRONT_PUBLIC_MAX_AGE = 60
+# Upper edges (KSh) of the storefront price facet buckets; the last bucket is open-ended
+STOREFRONT_PRICE_BUCKETS = [500, 1000, 2500, 5000, 10000, 25000]
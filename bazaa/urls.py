@@ -1,10 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from core.storage import media_urlpatterns
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),# Include pwa.urls under root URL ('/')
     path('', include('core.urls')),  # Include core.urls under root URL ('/')
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+] + media_urlpatterns()
\ No newline at end of file
@@ -49,8 +49,8 @@ admin.site.register(OTP, OTPAdmin)
 # -----------------------------
 @admin.register(Store)
 class StoreAdmin(admin.ModelAdmin):
-    list_display = ('name', 'owner', 'subdomain', 'whatsapp_number', 'created_at')
-    search_fields = ('name', 'subdomain', 'owner__username', 'whatsapp_number')
+    list_display = ('name', 'owner', 'subdomain', 'custom_domain', 'whatsapp_number', 'created_at')
+    search_fields = ('name', 'subdomain', 'custom_domain', 'owner__username', 'whatsapp_number')
     list_filter = ('created_at',)
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
@@ -87,11 +87,6 @@ class ProductAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     inlines = [ProductImageInline]
 
-    def save_model(self, request, obj, form, change):
-        """Calculate discount before saving."""
-        obj.calculate_discount()
-        super().save_model(request, obj, form, change)
-
 
 # -----------------------------
 # ProductImage Admin (optional)
@@ -105,6 +100,14 @@ class ProductImageAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
 
 
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('image', 'status', 'attempts', 'created_at', 'started_at')
+    list_filter = ('status',)
+    readonly_fields = ('image', 'attempts', 'error', 'created_at', 'started_at')
+    ordering = ('-created_at',)
+
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('product', 'user_name', 'created_at')
@@ -201,8 +204,26 @@ class PasswordResetAdmin(admin.ModelAdmin):
 
 @admin.register(Visitor)
 class VisitorAdmin(admin.ModelAdmin):
-    list_display = ('ip_address', 'session_key', 'url_path', 'method', 'visit_date', 'location')
-    list_filter = ('method', 'visit_date', 'location')
-    search_fields = ('ip_address', 'session_key', 'url_path', 'referrer', 'user_agent')
-    readonly_fields = ('visit_date',)
-    ordering = ('-visit_date',)
\ No newline at end of file
+    list_display = ('ip_address', 'session_key', 'path_value', 'method', 'visit_date', 'location_value')
+    list_filter = ('method', 'visit_date', 'country')
+    list_select_related = ('path_ref', 'location_ref')
+    search_fields = ('ip_address', 'session_key', 'path_ref__value', 'referrer_ref__value', 'user_agent_ref__value')
+    readonly_fields = ('visit_date', 'user_agent_value', 'referrer_value')
+    raw_id_fields = ('user_agent_ref', 'path_ref', 'referrer_ref', 'location_ref')
+    ordering = ('-visit_date',)
+
+
+@admin.register(VisitorDailyRollup)
+class VisitorDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'store_id', 'path', 'country', 'views', 'unique_visitors')
+    list_filter = ('bucket',)
+    search_fields = ('path', 'country')
+    ordering = ('-bucket', '-views')
+
+
+@admin.register(VisitorHourlyRollup)
+class VisitorHourlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'store_id', 'path', 'country', 'views', 'unique_visitors')
+    list_filter = ('bucket',)
+    search_fields = ('path', 'country')
+    ordering = ('-bucket', '-views')
@@ -0,0 +1,206 @@
+"""
+Visitor rollups.
+
+`rollup_visitors` folds new Visitor rows (id above the watermark) into
+hourly and daily buckets keyed by store, path and country, then purges raw
+rows that are both rolled up and older than the retention window.
+Dashboards read only from the rollup tables.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Count, Max, Min, Sum, TextField, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import RollupWatermark, Visitor, VisitorDailyRollup, VisitorHourlyRollup
+
+WATERMARK_NAME = "visitor_rollup"
+TOP_REFERRERS = 5
+
+ALL = VisitorHourlyRollup.ALL
+
+
+# -------------------------
+# Bucket helpers
+# -------------------------
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _hour_floor(value):
+    return timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+
+
+def retention_cutoff(days=None):
+    """Start of the oldest local day whose raw visits are kept."""
+    if days is None:
+        days = getattr(settings, "VISITOR_RETENTION_DAYS", 90)
+    return _day_start(timezone.localdate() - timedelta(days=days))
+
+
+# -------------------------
+# Rollup
+# -------------------------
+def _aggregate(visits, trunc):
+    """
+    Build rollup rows for `visits`, grouped by (bucket, store, path, country),
+    plus one store-wide row per (bucket, store).
+    """
+    visits = visits.annotate(
+        bucket=trunc("visit_date"),
+        rollup_path=Coalesce("path_ref__value", "url_path", Value(""), output_field=TextField()),
+        rollup_country=Coalesce("country", Value("")),
+        rollup_referrer=Coalesce("referrer_ref__value", "referrer", Value(""), output_field=TextField()),
+    )
+    key_fields = ("bucket", "store_id", "rollup_path", "rollup_country")
+
+    per_key = visits.values(*key_fields).annotate(
+        views=Count("id"), unique_visitors=Count("session_key", distinct=True)
+    )
+    per_store = visits.values("bucket", "store_id").annotate(
+        views=Count("id"), unique_visitors=Count("session_key", distinct=True)
+    )
+    referrer_hits = (
+        visits.exclude(rollup_referrer="")
+        .values(*key_fields, "rollup_referrer")
+        .annotate(hits=Count("id"))
+    )
+
+    referrers = defaultdict(Counter)
+    for row in referrer_hits:
+        key = tuple(row[field] for field in key_fields)
+        referrers[key][row["rollup_referrer"]] += row["hits"]
+        referrers[(row["bucket"], row["store_id"], ALL, ALL)][row["rollup_referrer"]] += row["hits"]
+
+    counts = [(tuple(row[field] for field in key_fields), row) for row in per_key]
+    counts += [((row["bucket"], row["store_id"], ALL, ALL), row) for row in per_store]
+
+    return [
+        {
+            "bucket": key[0],
+            "store_id": key[1],
+            "path": key[2],
+            "country": key[3],
+            "views": row["views"],
+            "unique_visitors": row["unique_visitors"],
+            "top_referrers": [list(item) for item in referrers[key].most_common(TOP_REFERRERS)],
+        }
+        for key, row in counts
+    ]
+
+
+def _rebuild(model, trunc, start, end, first_bucket, end_bucket):
+    visits = Visitor.objects.filter(visit_date__gte=start, visit_date__lt=end)
+    rows = _aggregate(visits, trunc)
+
+    with transaction.atomic(using=router.db_for_write(model)):
+        model.objects.filter(bucket__gte=first_bucket, bucket__lt=end_bucket).delete()
+        model.objects.bulk_create([model(**row) for row in rows], batch_size=500)
+
+    return len(rows)
+
+
+def run_rollup():
+    """
+    Fold Visitor rows newer than the watermark into the rollups.
+    Every hour/day bucket touched by a new row is recomputed from raw rows,
+    so counts (including distinct visitors) stay exact across runs.
+    """
+    watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+
+    new_visits = Visitor.objects.filter(id__gt=watermark.last_visitor_id)
+    bounds = new_visits.aggregate(max_id=Max("id"), first=Min("visit_date"), last=Max("visit_date"))
+    if bounds["max_id"] is None:
+        return {"visits": 0, "hourly": 0, "daily": 0}
+
+    # Buckets older than the retention cutoff may already be purged; leave them alone.
+    cutoff = retention_cutoff()
+    first = max(bounds["first"], cutoff)
+    last = max(bounds["last"], cutoff)
+
+    hour_start = _hour_floor(first)
+    hour_end = _hour_floor(last) + timedelta(hours=1)
+    hourly = _rebuild(VisitorHourlyRollup, TruncHour, hour_start, hour_end, hour_start, hour_end)
+
+    day_first = timezone.localtime(first).date()
+    day_end = timezone.localtime(last).date() + timedelta(days=1)
+    daily = _rebuild(
+        VisitorDailyRollup, TruncDate, _day_start(day_first), _day_start(day_end), day_first, day_end
+    )
+
+    visits = new_visits.filter(id__lte=bounds["max_id"]).count()
+    watermark.last_visitor_id = bounds["max_id"]
+    watermark.save(update_fields=["last_visitor_id", "updated_at"])
+
+    return {"visits": visits, "hourly": hourly, "daily": daily}
+
+
+# -------------------------
+# Retention
+# -------------------------
+def purge_visits(retention_days=None, batch_size=None):
+    """
+    Delete raw Visitor rows that are rolled up and older than the retention
+    window, `batch_size` rows per transaction. Returns the number deleted.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, "VISITOR_PURGE_BATCH_SIZE", 5000)
+
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+    if watermark is None:
+        return 0
+
+    expired = Visitor.objects.filter(
+        id__lte=watermark.last_visitor_id,
+        visit_date__lt=retention_cutoff(retention_days),
+    )
+
+    deleted = 0
+    while True:
+        ids = list(expired.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Visitor.objects.filter(id__in=ids).delete()[0]
+
+
+# -------------------------
+# Dashboard
+# -------------------------
+def store_traffic(store_id, days=14, top=5):
+    """Daily views/visitors and top pages/countries for a store, from rollups."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rollups = VisitorDailyRollup.objects.filter(store_id=store_id, bucket__gte=start)
+
+    totals = {
+        row["bucket"]: row
+        for row in rollups.filter(path=ALL, country=ALL).values("bucket", "views", "unique_visitors")
+    }
+
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = totals.get(day, {})
+        series.append({
+            "date": day,
+            "views": row.get("views", 0),
+            "unique_visitors": row.get("unique_visitors", 0),
+        })
+
+    peak = max((day["views"] for day in series), default=0)
+    for day in series:
+        day["percent"] = int(day["views"] * 100 / peak) if peak else 0
+
+    detail = rollups.exclude(path=ALL)
+    top_pages = detail.values("path").annotate(views=Sum("views")).order_by("-views")[:top]
+    top_countries = detail.values("country").annotate(views=Sum("views")).order_by("-views")[:top]
+
+    return {
+        "days": series,
+        "total_views": sum(day["views"] for day in series),
+        "top_pages": list(top_pages),
+        "top_countries": list(top_countries),
+    }
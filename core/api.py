@@ -0,0 +1,95 @@
+"""
+Storefront JSON API helpers: sparse fieldsets and compact serialization.
+
+`?fields=id,title,price` picks which product fields come back, and the
+queryset is narrowed with .only() to just the columns those fields need,
+so lightweight clients don't pay for captions and feature text they never
+show. The views live in core.views (STOREFRONT JSON API).
+"""
+import hashlib
+
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+
+from .models import Category
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def _attr(name):
+    return (name,), lambda product: getattr(product, name)
+
+
+def _image_url(size):
+    def get(product):
+        image = product.primary_image
+        if image is None:
+            return None
+        file = getattr(image, size) or image.image
+        return file.url if file else None
+    return get
+
+
+# api field → (Product columns it needs, getter)
+PRODUCT_FIELDS = {
+    **{name: _attr(name) for name in (
+        "id", "title", "caption", "price", "was_price", "percent_discount", "available_stock",
+        "about_1", "about_2", "about_3", "about_4", "like_count", "comment_count", "created_at", "updated_at",
+    )},
+    "url": ((), lambda product: reverse("product_detail", args=[product.id])),
+    "image": (("primary_image", "primary_image__image", "primary_image__image_medium"), _image_url("image_medium")),
+    "thumb": (("primary_image", "primary_image__image", "primary_image__image_thumb"), _image_url("image_thumb")),
+    "categories": ((), lambda product: [category.id for category in product.categories.all()]),
+}
+DEFAULT_FIELDS = ("id", "title", "price", "was_price", "percent_discount", "image", "url")
+
+# counters written without a content-version bump (core.signals): responses
+# that include them are tagged by their body instead
+LIVE_FIELDS = {"like_count", "comment_count"}
+
+
+def parse_fields(raw):
+    """Field names from a ?fields= value (DEFAULT_FIELDS when empty)."""
+    if not raw:
+        return DEFAULT_FIELDS
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in PRODUCT_FIELDS]
+    if unknown:
+        raise InvalidFields(f"Unknown field(s): {', '.join(unknown)}")
+    return tuple(fields) or DEFAULT_FIELDS
+
+
+def project(queryset, fields, extra_columns=()):
+    """Narrow a Product queryset to the columns (and relations) `fields` need."""
+    # store: querysets from store.products read it to attach the known store
+    columns = {"id", "store", *extra_columns}
+    for name in fields:
+        columns.update(PRODUCT_FIELDS[name][0])
+
+    queryset = queryset.select_related(None)
+    if "primary_image" in columns:
+        queryset = queryset.select_related("primary_image")
+    if "categories" in fields:
+        queryset = queryset.prefetch_related(Prefetch("categories", queryset=Category.objects.only("id")))
+    return queryset.only(*columns)
+
+
+def serialize(product, fields):
+    return {name: PRODUCT_FIELDS[name][1](product) for name in fields}
+
+
+def json_response(request, data, tag_body=False, status=200):
+    """
+    Compact JSON. With `tag_body` the ETag is a hash of the body (for
+    responses the version-based ETag can't describe), and a matching
+    If-None-Match gets a 304.
+    """
+    response = JsonResponse(data, status=status, json_dumps_params={"separators": (",", ":")})
+    if tag_body and status == 200:
+        response["ETag"] = f'"{hashlib.md5(response.content).hexdigest()}"'
+        return get_conditional_response(request, etag=response["ETag"], response=response)
+    return response
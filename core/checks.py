@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+PROCESS_LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+# alias → what it holds; see CACHES in settings
+SHARED_CACHES = {
+    "default": "Storefront fragments and facets",
+    "stores": "Store lookups and content versions (fragment keys and ETags)",
+}
+REQUIRED_CACHES = (*SHARED_CACHES, "local")
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """The caches core uses must exist, and the ones holding invalidations must be shared between workers."""
+    messages = []
+    for alias in REQUIRED_CACHES:
+        if alias not in settings.CACHES:
+            messages.append(Error(
+                f"CACHES has no {alias!r} cache.",
+                hint="See CACHES in bazaa/settings.py for the aliases core uses.",
+                id="core.E001",
+            ))
+    for alias, contents in SHARED_CACHES.items():
+        backend = settings.CACHES.get(alias, {}).get("BACKEND", "")
+        if backend in PROCESS_LOCAL_CACHES:
+            messages.append(Warning(
+                f"The {alias!r} cache ({backend}) is not shared between worker processes.",
+                hint=f"{contents} go stale in every worker but the one that saw a change. "
+                     "Configure a database, Redis or Memcached cache for it in CACHES.",
+                id="core.W001",
+            ))
+    return messages
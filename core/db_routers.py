@@ -0,0 +1,80 @@
+"""
+Database routing.
+
+Visitor tracking and its rollup/lookup tables live in the "analytics"
+database so that heavy tracking inserts never wait on the SQLite write lock
+held by catalog, session or like/comment writes in "default".
+
+The shared DatabaseCache tables (settings.CACHES) live in the "cache"
+database, so cache writes never queue behind either of them.
+
+Run migrations for both aliases and create the cache tables:
+    python manage.py migrate
+    python manage.py migrate --database=analytics
+    python manage.py createcachetable --database=cache
+"""
+
+ANALYTICS_DB = "analytics"
+CACHE_DB = "cache"
+CACHE_APP_LABEL = "django_cache"  # what DatabaseCache's model stand-in reports
+
+ANALYTICS_MODELS = {
+    "visitor",
+    "visitoruseragent",
+    "visitorpath",
+    "visitorreferrer",
+    "visitorlocation",
+    "visitorhourlyrollup",
+    "visitordailyrollup",
+    "rollupwatermark",
+}
+
+
+def is_analytics_model(app_label, model_name):
+    return app_label == "core" and model_name in ANALYTICS_MODELS
+
+
+class AnalyticsRouter:
+    def _db_for(self, model):
+        if is_analytics_model(model._meta.app_label, model._meta.model_name):
+            return ANALYTICS_DB
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        in_analytics = {
+            is_analytics_model(obj._meta.app_label, obj._meta.model_name) for obj in (obj1, obj2)
+        }
+        return len(in_analytics) == 1
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is not None and is_analytics_model(app_label, model_name):
+            return db == ANALYTICS_DB
+        if db == ANALYTICS_DB:
+            return False
+        return None
+
+
+class CacheRouter:
+    def _db_for(self, model):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return CACHE_DB
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == CACHE_APP_LABEL:
+            return db == CACHE_DB
+        if db == CACHE_DB:
+            return False
+        return None
@@ -0,0 +1,89 @@
+"""
+Storefront facets: active-product counts per category and a price
+histogram for the current search.
+
+Category counts are one GROUP BY over the product/category M2M table, and
+the histogram is one aggregate with a filtered COUNT per price bucket.
+Both follow the usual facet rule: a facet ignores its own selection
+(category counts keep the price filter but not the category filter, and
+the reverse), so shoppers can see what switching would give them.
+Results are cached under the store's content version.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Product
+from .store_cache import get_content_version
+
+ProductCategory = Product.categories.through
+
+
+def price_buckets():
+    """[(low, high), ...] from STOREFRONT_PRICE_BUCKETS; the last bucket is open-ended."""
+    edges = getattr(settings, "STOREFRONT_PRICE_BUCKETS", [500, 1000, 2500, 5000, 10000, 25000])
+    lows = [0, *edges]
+    return list(zip(lows, [*edges, None]))
+
+
+def price_token(low, high):
+    return f"{low}-{'' if high is None else high}"
+
+
+def parse_price(token):
+    """(low, high) for a "low-high" token ("low-" = and up), or None if malformed."""
+    token = token or ""
+    low, sep, high = token.partition("-")
+    # isascii(): isdigit() also passes "²", which int() rejects
+    if not sep or not token.isascii() or not low.isdigit() or (high and not high.isdigit()):
+        return None
+    low, high = int(low), int(high) if high else None
+    if high is not None and high <= low:
+        return None
+    return low, high
+
+
+def price_q(low, high):
+    q = Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def compute_facets(category_products, price_products):
+    """
+    category_products: listing queryset without the category filter.
+    price_products: listing queryset without the price filter.
+    """
+    categories = [
+        {"id": row["category_id"], "name": row["category__name"], "count": row["count"]}
+        for row in ProductCategory.objects
+        .filter(product__in=category_products.values("id"))
+        .values("category_id", "category__name")
+        .annotate(count=Count("product_id", distinct=True))
+        .order_by("category__name")
+    ]
+
+    buckets = price_buckets()
+    counts = price_products.order_by().aggregate(**{
+        f"b{i}": Count("id", filter=price_q(low, high)) for i, (low, high) in enumerate(buckets)
+    })
+    prices = [
+        {"token": price_token(low, high), "min": low, "max": high, "count": counts[f"b{i}"]}
+        for i, (low, high) in enumerate(buckets)
+        if counts[f"b{i}"]
+    ]
+    return {"categories": categories, "prices": prices}
+
+
+def get_facets(store, params, category_products, price_products):
+    """compute_facets(), cached per store content version and listing parameters."""
+    digest = hashlib.md5("|".join(params).encode()).hexdigest()
+    key = f"storefront:facets:{store.id}:{get_content_version(store.id)}:{digest}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(category_products, price_products)
+        cache.set(key, facets, getattr(settings, "STOREFRONT_FRAGMENT_TTL", 3600))
+    return facets
@@ -0,0 +1,252 @@
+"""
+Offline IP → location lookups.
+
+Ranges are imported from CSV by `manage.py import_geoip` into a compact
+binary file (settings.GEOIP_DATABASE). The file is loaded once per process
+into sorted arrays and answered with a binary search, so resolving a
+visitor's location never touches the network.
+"""
+import ipaddress
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BZGEO\x01"
+_HEADER = struct.Struct("<III")  # locations, IPv4 ranges, IPv6 ranges
+MAX_LABEL_BYTES = 0xFFFF  # location labels are length-prefixed with a uint16
+
+
+def _int_array(values=()):
+    return array("I", values)
+
+
+class GeoIPDatabase:
+    """Sorted, non-overlapping IP ranges mapped to location labels."""
+
+    def __init__(self, locations, v4, v6):
+        # v4 / v6: (starts, ends, location indexes), all sorted by start
+        self.locations = locations
+        self.v4_starts, self.v4_ends, self.v4_locs = v4
+        self.v6_starts, self.v6_ends, self.v6_locs = v6
+
+    def __len__(self):
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    # -------------------------
+    # Lookup
+    # -------------------------
+    def lookup(self, ip_address):
+        """Return the location label for an IP address, or None."""
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except (TypeError, ValueError):
+            return None
+
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+
+        if ip.version == 4:
+            starts, ends, locs = self.v4_starts, self.v4_ends, self.v4_locs
+        else:
+            starts, ends, locs = self.v6_starts, self.v6_ends, self.v6_locs
+
+        value = int(ip)
+        i = bisect_right(starts, value) - 1
+        if i < 0 or value > ends[i]:
+            return None
+        return self.locations[locs[i]]
+
+    # -------------------------
+    # Building
+    # -------------------------
+    @classmethod
+    def from_ranges(cls, ranges):
+        """
+        Build a database from (start_ip, end_ip, location) tuples.
+        IPs may be strings or ipaddress objects. Raises ValueError for
+        inverted or overlapping ranges and over-long location labels.
+        """
+        location_ids = {}
+        rows = {4: [], 6: []}
+
+        for start, end, location in ranges:
+            start = ipaddress.ip_address(start)
+            end = ipaddress.ip_address(end)
+            if start.version != end.version or int(end) < int(start):
+                raise ValueError(f"Invalid range {start} - {end}")
+            if len(location.encode("utf-8")) > MAX_LABEL_BYTES:
+                raise ValueError(f"Location label of {start} - {end} is longer than {MAX_LABEL_BYTES} bytes")
+            loc_id = location_ids.setdefault(location, len(location_ids))
+            rows[start.version].append((int(start), int(end), loc_id))
+
+        locations = [None] * len(location_ids)
+        for label, loc_id in location_ids.items():
+            locations[loc_id] = label
+
+        for version, version_rows in rows.items():
+            version_rows.sort()
+            # lookups bisect on the starts, so no range may reach into the next one
+            address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+            for previous, row in zip(version_rows, version_rows[1:]):
+                if row[0] <= previous[1]:
+                    raise ValueError(
+                        f"Overlapping ranges {address(previous[0])} - {address(previous[1])} "
+                        f"and {address(row[0])} - {address(row[1])}"
+                    )
+        v4 = (
+            _int_array(r[0] for r in rows[4]),
+            _int_array(r[1] for r in rows[4]),
+            _int_array(r[2] for r in rows[4]),
+        )
+        v6 = (
+            [r[0] for r in rows[6]],
+            [r[1] for r in rows[6]],
+            _int_array(r[2] for r in rows[6]),
+        )
+        return cls(locations, v4, v6)
+
+    # -------------------------
+    # File format
+    # -------------------------
+    def save(self, path):
+        """Write the database atomically to `path`."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(MAGIC)
+            fh.write(_HEADER.pack(len(self.locations), len(self.v4_starts), len(self.v6_starts)))
+
+            for label in self.locations:
+                encoded = label.encode("utf-8")
+                fh.write(struct.pack("<H", len(encoded)))
+                fh.write(encoded)
+
+            for arr in (self.v4_starts, self.v4_ends, self.v4_locs):
+                fh.write(_to_little_endian(arr))
+
+            for values in (self.v6_starts, self.v6_ends):
+                fh.write(b"".join(v.to_bytes(16, "big") for v in values))
+            fh.write(_to_little_endian(self.v6_locs))
+
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a database written by save(). Raises ValueError for anything else."""
+        with open(path, "rb") as fh:
+            data = fh.read()
+
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{path} is not a GeoIP database.")
+        try:
+            return cls._parse(data)
+        except (struct.error, UnicodeDecodeError, ValueError) as exc:
+            raise ValueError(f"{path} is not a valid GeoIP database ({exc}).") from exc
+
+    @classmethod
+    def _parse(cls, data):
+        offset = len(MAGIC)
+        n_locations, n_v4, n_v6 = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+
+        locations = []
+        for _ in range(n_locations):
+            (length,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            locations.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+
+        v4 = []
+        for _ in range(3):
+            arr, offset = _read_array(data, offset, n_v4)
+            v4.append(arr)
+
+        v6 = []
+        for _ in range(2):
+            chunk = data[offset:offset + n_v6 * 16]
+            v6.append([int.from_bytes(chunk[i:i + 16], "big") for i in range(0, len(chunk), 16)])
+            offset += n_v6 * 16
+        arr, offset = _read_array(data, offset, n_v6)
+        v6.append(arr)
+
+        if offset != len(data):
+            raise ValueError("file size does not match its header")
+        if max(v4[2], default=-1) >= n_locations or max(v6[2], default=-1) >= n_locations:
+            raise ValueError("range points at a missing location")
+        return cls(locations, tuple(v4), tuple(v6))
+
+
+def _to_little_endian(arr):
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _read_array(data, offset, count):
+    arr = _int_array()
+    size = count * arr.itemsize
+    arr.frombytes(data[offset:offset + size])
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr, offset + size
+
+
+# -------------------------
+# Process-wide instance
+# -------------------------
+_database = None
+_database_mtime = None
+_checked_at = None
+_lock = threading.Lock()
+
+RELOAD_CHECK_INTERVAL = 60  # seconds between checks for a refreshed file
+
+
+def get_database():
+    """
+    Return the loaded database (or None if no file has been imported).
+    The file is re-read when `import_geoip` replaces it; a file that can't
+    be read is logged once and the previous database kept meanwhile.
+    """
+    global _database, _database_mtime, _checked_at
+
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return _database
+
+    with _lock:
+        _checked_at = now
+        path = getattr(settings, "GEOIP_DATABASE", None)
+        try:
+            mtime = os.stat(path).st_mtime if path else None
+        except OSError:
+            mtime = None
+
+        if mtime is None:
+            _database, _database_mtime = None, None
+        elif mtime != _database_mtime:
+            # remembered even on failure, so a bad file is reported once, not every minute
+            _database_mtime = mtime
+            try:
+                _database = GeoIPDatabase.load(path)
+            except (OSError, ValueError):
+                logger.exception("Could not load the GeoIP database; keeping the previous one.")
+
+    return _database
+
+
+def lookup(ip_address):
+    """Location label for `ip_address` from the local database, or None."""
+    database = get_database()
+    if database is None:
+        return None
+    return database.lookup(ip_address)
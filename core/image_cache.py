@@ -0,0 +1,241 @@
+"""
+On-demand image resizing.
+
+/resize/<kind>/<pk>/<width>/<signature>.<ext> serves a ProductImage
+("product") or Store.logo ("logo") at any width in IMAGE_RESIZE_WIDTHS and
+any encodable format (core.renditions). URLs come from resized_url(); the
+signature covers the source file name as well, so a replaced upload gets
+new URLs and old ones stop resolving — which is what lets responses be
+cached as immutable.
+
+Results live in a size-bounded on-disk LRU (DiskLRU): hits touch the
+file's mtime, and once the directory grows past IMAGE_RESIZE_CACHE_MAX_BYTES
+the least recently used files are evicted. Concurrent misses for the same
+rendition are single-flighted with a file lock (one per cache shard), so
+a cold cache resizes each rendition once, across threads and worker
+processes alike.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from PIL import Image
+
+from .models import ProductImage, Store
+from .renditions import available_formats, render_width
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: single-flight within the process only
+    fcntl = None
+
+SIGNATURE_SALT = "core.image-resize"
+DEFAULT_WIDTHS = (160, 320, 480, 640, 960, 1200, 1600)
+
+SOURCES = {
+    "product": (ProductImage, "image"),
+    "logo": (Store, "logo"),
+}
+
+
+class InvalidResize(Exception):
+    pass
+
+
+def allowed_widths():
+    return tuple(getattr(settings, "IMAGE_RESIZE_WIDTHS", DEFAULT_WIDTHS))
+
+
+def format_for(extension):
+    for fmt in available_formats():
+        if fmt.extension == extension:
+            return fmt
+    return None
+
+
+def _signature(kind, pk, width, extension, source_name):
+    value = f"{kind}:{pk}:{width}:{extension}:{source_name}"
+    return signing.Signer(salt=SIGNATURE_SALT).signature(value)
+
+
+def resized_url(obj, width, extension="webp"):
+    """Signed URL of `obj` (a ProductImage or Store) resized to `width`; "" without an image."""
+    kind = next((kind for kind, (model, _) in SOURCES.items() if isinstance(obj, model)), None)
+    if kind is None:
+        raise TypeError(f"Can't resize {type(obj).__name__} objects.")
+    if width not in allowed_widths():
+        raise ValueError(f"Width {width} is not in IMAGE_RESIZE_WIDTHS.")
+    if format_for(extension) is None:
+        raise ValueError(f"Format {extension!r} can't be encoded here.")
+
+    source = getattr(obj, SOURCES[kind][1])
+    if not source:
+        return ""
+    signature = _signature(kind, obj.pk, width, extension, source.name)
+    return reverse("image_resize", args=[kind, obj.pk, width, signature, extension])
+
+
+def resolve(kind, pk, width, signature, extension):
+    """(source FieldFile, Format) for a resize URL. Raises InvalidResize."""
+    if kind not in SOURCES or width not in allowed_widths():
+        raise InvalidResize("Unknown source kind or width.")
+    fmt = format_for(extension)
+    if fmt is None:
+        raise InvalidResize("Unknown format.")
+
+    model, field = SOURCES[kind]
+    obj = model.objects.only("pk", field).filter(pk=pk).first()
+    source = getattr(obj, field, None)
+    if not source:
+        raise InvalidResize("No such image.")
+    expected = _signature(kind, pk, width, extension, source.name)
+    if not signing.constant_time_compare(signature, expected):
+        raise InvalidResize("Bad or outdated signature.")
+    return source, fmt
+
+
+# -------------------------
+# Disk cache
+# -------------------------
+class DiskLRU:
+    """
+    Files under `directory`, at most about `max_bytes` in total. Each process
+    keeps a running estimate of the size and rescans before evicting, so
+    several processes may share one directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+        self._flights = {}  # shard → threading.Lock, where fcntl is unavailable
+
+    def path(self, key, extension):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.{extension}"
+
+    def open(self, key, extension, create):
+        """The cached file for `key` opened for reading, calling create() → bytes on a miss."""
+        path = self.path(key, extension)
+        file = self._open(path)
+        if file is not None:
+            return file
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._single_flight(path):
+            file = self._open(path)  # rendered by whoever held the lock
+            if file is not None:
+                return file
+            data = create()
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            # opened before anyone can evict it; an open file survives unlink
+            file = open(path, "rb")
+
+        self._grew(len(data))
+        return file
+
+    def _open(self, path):
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mtime is the LRU clock
+        except OSError:
+            pass
+        return file
+
+    def _single_flight(self, path):
+        # one lock per shard directory: bounded, and rarely contended
+        if fcntl is not None:
+            return _FileLock(path.parent / ".lock")
+        with self._lock:
+            return self._flights.setdefault(path.parent.name, threading.Lock())
+
+    def _files(self):
+        for entry in self.directory.glob("*/*"):
+            if not entry.name.startswith("."):  # locks and partial writes
+                try:
+                    yield entry, entry.stat()
+                except FileNotFoundError:
+                    pass  # evicted by another process meanwhile
+
+    def _grew(self, added):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._files())
+            else:
+                self._size += added
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _evict(self):
+        """Delete least recently used files down to 90% of max_bytes; returns the new size."""
+        files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+        size = sum(stat.st_size for _, stat in files)
+        target = self.max_bytes * 0.9
+        for entry, stat in files:
+            if size <= target:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            size -= stat.st_size
+        return size
+
+
+class _FileLock:
+    """Exclusive flock on `path` (held across threads and processes)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskLRU(
+                getattr(settings, "IMAGE_RESIZE_CACHE_DIR", Path(settings.BASE_DIR) / "image_cache"),
+                getattr(settings, "IMAGE_RESIZE_CACHE_MAX_BYTES", 512 * 1024 * 1024),
+            )
+    return _cache
+
+
+def open_resized(source, width, fmt):
+    """
+    `source` resized to `width` in `fmt`, opened for reading; rendered at most
+    once. Raises InvalidResize if the source file is gone or isn't an image.
+    """
+    def create():
+        try:
+            with source.open("rb") as f:
+                return render_width(f, width, fmt)
+        except (OSError, Image.DecompressionBombError) as exc:  # FileNotFoundError, UnidentifiedImageError, truncated
+            raise InvalidResize(f"Can't read {source.name}: {exc}") from exc
+
+    key = f"{source.name}:{width}:{fmt.name}"
+    return get_cache().open(key, fmt.extension, create)
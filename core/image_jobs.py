@@ -0,0 +1,143 @@
+"""
+Product image derivative queue.
+
+With IMAGE_DERIVATIVE_MODE = "queued", ProductImage.save() stores only the
+original upload and inserts an ImageJob row. `manage.py process_image_jobs`
+claims pending jobs and renders them in a process pool, so the LANCZOS
+resizes and JPEG encodes run in parallel and never on a request thread.
+Until a job finishes, ProductImage.thumb_url and medium_url fall back to
+the original upload.
+
+Jobs are claimed with a conditional UPDATE, so several workers can share
+the queue. A job left "running" longer than IMAGE_JOB_TIMEOUT (a killed
+worker) goes back to pending.
+"""
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ImageJob, ProductImage
+from .store_cache import bump_content_version
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_missing():
+    """Queue every image lacking a derivative (and not already queued); returns how many."""
+    missing = Q()
+    for field in ProductImage.DERIVED_FIELDS:
+        missing |= Q(**{f"{field}__isnull": True}) | Q(**{field: ""})
+    missing |= Q(renditions={})
+    image_ids = ProductImage.objects.filter(missing).exclude(jobs__status=ImageJob.PENDING).values_list("id", flat=True)
+    return len(ImageJob.objects.bulk_create([ImageJob(image_id=image_id) for image_id in image_ids]))
+
+
+# -------------------------
+# Claiming
+# -------------------------
+def claim(limit):
+    """Mark up to `limit` pending jobs as running and return their ids."""
+    now = timezone.now()
+    timeout = getattr(settings, "IMAGE_JOB_TIMEOUT", 600)
+    ImageJob.objects.filter(status=ImageJob.RUNNING, started_at__lt=now - timedelta(seconds=timeout)) \
+        .update(status=ImageJob.PENDING)
+
+    candidates = (
+        ImageJob.objects.filter(status=ImageJob.PENDING)
+        .order_by("created_at", "id").values_list("id", flat=True)[:limit]
+    )
+    claimed = []
+    for job_id in candidates:
+        # another worker may have taken it since the SELECT
+        if ImageJob.objects.filter(pk=job_id, status=ImageJob.PENDING) \
+                .update(status=ImageJob.RUNNING, started_at=now, attempts=F("attempts") + 1):
+            claimed.append(job_id)
+    return claimed
+
+
+def finish(job_id, error=None):
+    if error is None:
+        ImageJob.objects.filter(pk=job_id).delete()
+        return
+    max_attempts = getattr(settings, "IMAGE_JOB_MAX_ATTEMPTS", 3)
+    job = ImageJob.objects.filter(pk=job_id).only("attempts").first()
+    if job is None:
+        return
+    status = ImageJob.FAILED if job.attempts >= max_attempts else ImageJob.PENDING
+    ImageJob.objects.filter(pk=job_id).update(status=status, error=error)
+    logger.warning("Image job %s failed (attempt %s, now %s): %s", job_id, job.attempts, status, error)
+
+
+# -------------------------
+# Rendering (runs in pool processes)
+# -------------------------
+def render(job_id):
+    """Generate the derivatives for one job. Returns None or the error text."""
+    close_old_connections()
+    try:
+        job = ImageJob.objects.select_related("image__product").filter(pk=job_id).first()
+        if job is None:
+            return None  # the image was deleted and took its job with it
+        image = job.image
+        image._generate_resized()
+
+        # one conditional UPDATE (no signals): skipped if the original was
+        # replaced or deleted while we were resizing — its own job will run
+        saved = ProductImage.objects.filter(pk=image.pk, image=image.image.name).update(
+            updated_at=timezone.now(),
+            renditions=image.renditions,
+            **{field: getattr(image, field).name for field in ProductImage.DERIVED_FIELDS},
+        )
+        if not saved:
+            image._clear_derived()
+            return None
+        bump_content_version(image.product.store_id)
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+
+def run(workers=None, batch_size=None, once=False, poll_interval=2.0, stdout=None):
+    """Process jobs until the queue is empty (`once`) or forever. Returns how many succeeded."""
+    workers = workers or getattr(settings, "IMAGE_JOB_WORKERS", None) or os.cpu_count() or 1
+    batch_size = batch_size or workers * 2
+    done = 0
+
+    # spawn: children set Django up themselves and open their own connections
+    connections.close_all()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+        while True:
+            job_ids = claim(batch_size)
+            if not job_ids:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            started = time.monotonic()
+            futures = {pool.submit(render, job_id): job_id for job_id in job_ids}
+            failed = 0
+            for future in as_completed(futures):
+                try:
+                    error = future.result()
+                except Exception as exc:  # e.g. a pool process died
+                    error = repr(exc)
+                finish(futures[future], error)
+                failed += error is not None
+            done += len(job_ids) - failed
+            if stdout:
+                stdout.write(
+                    f"Rendered {len(job_ids) - failed}/{len(job_ids)} image(s) in {time.monotonic() - started:.2f}s."
+                )
+    return done
@@ -0,0 +1,98 @@
+"""
+Dictionary encoding for Visitor strings.
+
+User agents, paths, referrers and locations repeat across millions of
+visits but only have a few thousand distinct values. Each distinct value
+is stored once in its lookup table and Visitor rows keep the integer id.
+A per-process LRU maps string → id so known values never hit the DB.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Visitor, VisitorLocation, VisitorPath, VisitorReferrer, VisitorUserAgent
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class Interner:
+    """string → lookup-table id, with a bounded LRU in front of the table."""
+
+    def __init__(self, model, max_size=5000):
+        self.model = model
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, value):
+        with self._lock:
+            pk = self._cache.get(value)
+            if pk is not None:
+                self._cache.move_to_end(value)
+            return pk
+
+    def _remember(self, value, pk):
+        with self._lock:
+            self._cache[value] = pk
+            self._cache.move_to_end(value)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def get_ids(self, values):
+        """Return {value: id} for every value, creating missing rows in bulk."""
+        ids = {}
+        missing = {}
+        for value in set(values):
+            pk = self._cached(value)
+            if pk is None:
+                missing[_digest(value)] = value
+            else:
+                ids[value] = pk
+
+        if not missing:
+            return ids
+
+        existing = dict(self.model.objects.filter(digest__in=missing).values_list("digest", "id"))
+        new_rows = [self.model(digest=d, value=v) for d, v in missing.items() if d not in existing]
+        if new_rows:
+            # another process may insert the same value concurrently
+            self.model.objects.bulk_create(new_rows, ignore_conflicts=True)
+            existing = dict(self.model.objects.filter(digest__in=missing).values_list("digest", "id"))
+
+        for digest, value in missing.items():
+            ids[value] = existing[digest]
+            self._remember(value, existing[digest])
+        return ids
+
+    def get_id(self, value):
+        return self.get_ids([value])[value]
+
+
+_cache_size = getattr(settings, "VISITOR_INTERN_CACHE_SIZE", 5000)
+
+INTERNERS = {
+    "user_agent": Interner(VisitorUserAgent, _cache_size),
+    "url_path": Interner(VisitorPath, _cache_size),
+    "referrer": Interner(VisitorReferrer, _cache_size),
+    "location": Interner(VisitorLocation, _cache_size),
+}
+
+
+def encode_visits(visits):
+    """
+    Move the raw strings of unsaved/unencoded Visitor instances into the
+    lookup tables, in place. Empty strings are stored as NULL.
+    """
+    for field, ref_field in Visitor.ENCODED_FIELDS.items():
+        values = [getattr(v, field) for v in visits if getattr(v, field)]
+        ids = INTERNERS[field].get_ids(values) if values else {}
+        for visit in visits:
+            value = getattr(visit, field)
+            if value:
+                setattr(visit, f"{ref_field}_id", ids[value])
+            setattr(visit, field, None)
+    return visits
@@ -0,0 +1,151 @@
+"""
+Like toggling.
+
+- LIKE_WRITE_MODE = "sync" → each toggle is one short write transaction:
+  an INSERT that does nothing if the like exists (then a DELETE), and the
+  counter UPDATE, which returns the new count. A double-click race ends in
+  ON CONFLICT instead of a duplicate row.
+- LIKE_WRITE_MODE = "buffered" → toggles are queued in-process and applied
+  in batches by a background thread (core.write_buffer). Repeated toggles
+  of the same like coalesce to the last state, and each batch is one
+  transaction. The response carries an optimistic count.
+
+Both paths write with SQL that skips the Like signals and maintain
+Product.like_count themselves: the sync path by one, the buffered path by
+recounting each batch's products.
+"""
+import itertools
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import Like, Product, recount
+from .write_buffer import BufferedWriter
+
+# toggles not yet written: product_id → {user_ip: (liked_in_db, liked, seq)}
+_pending = defaultdict(dict)
+_pending_lock = threading.Lock()
+_seq = itertools.count()
+
+
+def _db():
+    return router.db_for_write(Like)
+
+
+# -------------------------
+# Synchronous
+# -------------------------
+def _toggle_now(product_id, user_ip):
+    """
+    Flip one like and return (liked, like_count). SQL has no one statement that
+    inserts a row or else deletes it, so this is the shortest write
+    transaction that can: INSERT ... ON CONFLICT DO NOTHING, a DELETE only if
+    the like was there, then the counter UPDATE ... RETURNING the new count.
+    """
+    db = _db()
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    like, product = qn(Like._meta.db_table), qn(Product._meta.db_table)
+    params = [product_id, Like._meta.get_field("user_ip").get_db_prep_save(user_ip, connection)]
+    returning = connection.features.can_return_columns_from_insert  # RETURNING: SQLite 3.35+
+
+    with transaction.atomic(using=db), connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {like} (product_id, user_ip, created_at) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+            [*params, connection.ops.adapt_datetimefield_value(timezone.now())],
+        )
+        liked = cursor.rowcount == 1
+        if liked:
+            update = f"UPDATE {product} SET like_count = like_count + 1 WHERE id = %s"
+        else:
+            cursor.execute(f"DELETE FROM {like} WHERE product_id = %s AND user_ip = %s", params)
+            # the > 0 guard keeps a drifted counter from going negative
+            update = f"UPDATE {product} SET like_count = like_count - 1 WHERE id = %s AND like_count > 0"
+        cursor.execute(update + (" RETURNING like_count" if returning else ""), [product_id])
+        row = cursor.fetchone() if returning else None
+        if row is None:  # no RETURNING, or the guard skipped the update
+            cursor.execute(f"SELECT like_count FROM {product} WHERE id = %s", [product_id])
+            row = cursor.fetchone()
+    return liked, row[0] if row else 0
+
+
+# -------------------------
+# Write-behind
+# -------------------------
+def _apply_toggles(events):
+    """Write a batch of (product_id, user_ip, liked, seq) events, last one per like wins."""
+    final = {}
+    for product_id, user_ip, liked, seq in events:
+        final[(product_id, user_ip)] = (liked, seq)
+
+    by_product = defaultdict(dict)
+    for (product_id, user_ip), (liked, _seq_) in final.items():
+        by_product[product_id][user_ip] = liked
+
+    db = _db()
+    try:
+        with transaction.atomic(using=db):
+            existing = set(
+                Like.objects.filter(product_id__in=by_product, user_ip__in={ip for _, ip in final})
+                            .values_list("product_id", "user_ip")
+            )
+            new_likes, changed = [], set()
+            for product_id, states in by_product.items():
+                added = [ip for ip, liked in states.items() if liked and (product_id, ip) not in existing]
+                removed = [ip for ip, liked in states.items() if not liked and (product_id, ip) in existing]
+                new_likes += [Like(product_id=product_id, user_ip=ip) for ip in added]
+                if removed:
+                    # one DELETE, without per-row post_delete signals: recounted below
+                    Like.objects.filter(product_id=product_id, user_ip__in=removed)._raw_delete(db)
+                if added or removed:
+                    changed.add(product_id)
+            Like.objects.bulk_create(new_likes, ignore_conflicts=True)
+            # a recount, not += len(added): bulk_create can't tell which rows another
+            # process inserted first
+            Product.objects.filter(pk__in=changed).update(like_count=recount(Like))
+    finally:
+        # written or lost (the writer logs the error): either way these toggles
+        # no longer adjust the optimistic counts, which fall back to the DB
+        with _pending_lock:
+            for (product_id, user_ip), (_liked, seq) in final.items():
+                likes = _pending.get(product_id)
+                if likes and likes.get(user_ip, (None, None, None))[2] == seq:
+                    del likes[user_ip]
+                    if not likes:
+                        del _pending[product_id]
+
+
+def get_writer():
+    """Return the process-wide like buffer, creating it on first use."""
+    return BufferedWriter.singleton("like-writer", _apply_toggles, "LIKE", batch_size=500, flush_interval=0.3)
+
+
+def _toggle_buffered(product, user_ip):
+    with _pending_lock:
+        entry = _pending.get(product.pk, {}).get(user_ip)
+    if entry is None:
+        liked_in_db = Like.objects.filter(product_id=product.pk, user_ip=user_ip).exists()
+        current = liked_in_db
+    else:
+        liked_in_db, current, _seq_ = entry
+
+    liked, seq = not current, next(_seq)
+    with _pending_lock:
+        _pending[product.pk][user_ip] = (liked_in_db, liked, seq)
+        delta = sum(int(now) - int(before) for before, now, _ in _pending[product.pk].values())
+
+    if not get_writer().put((product.pk, user_ip, liked, seq)):
+        _apply_toggles([(product.pk, user_ip, liked, seq)])  # queue full: write it ourselves
+    return liked, max(product.like_count + delta, 0)
+
+
+def toggle_like(product, user_ip):
+    """Like or unlike `product` for `user_ip`. Returns (liked, like_count)."""
+    if getattr(settings, "LIKE_WRITE_MODE", "sync") == "buffered":
+        return _toggle_buffered(product, user_ip)
+
+    liked, product.like_count = _toggle_now(product.pk, user_ip)
+    return liked, product.like_count
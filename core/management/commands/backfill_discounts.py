@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Product
+from core.store_cache import bump_content_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Product.percent_discount from price/was_price for every product. "
+        "Product.save() keeps it current; run this after bulk .update()s or imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        products = Product.objects.only("id", "store_id", "price", "was_price", "percent_discount").order_by("id")
+
+        checked = updated = 0
+        changed = []
+        stores = set()
+        for product in products.iterator(chunk_size=chunk_size):
+            checked += 1
+            before = product.percent_discount
+            product.calculate_discount()
+            if product.percent_discount != before:
+                changed.append(product)
+                stores.add(product.store_id)
+            if len(changed) >= chunk_size:
+                updated += Product.objects.bulk_update(changed, ["percent_discount"])
+                changed = []
+        if changed:
+            updated += Product.objects.bulk_update(changed, ["percent_discount"])
+
+        # bulk_update skips signals: retire the cached storefront fragments ourselves
+        for store_id in stores:
+            bump_content_version(store_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} products, updated {updated}."))
@@ -0,0 +1,94 @@
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from core.renditions import FORMATS, RENDITIONS, available_formats, render
+
+JPEG = next(fmt for fmt in FORMATS if fmt.name == "jpeg")
+
+
+def _legacy_render(data):
+    """The previous pipeline: a full decode, RGB convert and LANCZOS resize per rendition."""
+    for rendition in RENDITIONS:
+        img = Image.open(BytesIO(data)).convert("RGB")
+        img.thumbnail(rendition.size, Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=JPEG.quality, optimize=True)
+
+
+def _engine_render(data):
+    # same outputs as the legacy pipeline: the JPEG renditions only
+    render(BytesIO(data), ladder=(), formats=(JPEG,))
+
+
+PIPELINES = {"legacy": _legacy_render, "engine": _engine_render}
+
+
+def _measure(pipeline, data, repeat):
+    """Runs in a fresh process: (CPU seconds per image, peak RSS growth in MB)."""
+    func = PIPELINES[pipeline]
+    Image.init()  # load the codec plugins before taking the baseline
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.process_time()
+    for _ in range(repeat):
+        func(data)
+    cpu = (time.process_time() - started) / repeat
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return cpu, peak / 1024  # ru_maxrss is in KiB on Linux
+
+
+def _sample_jpeg(megapixels):
+    """A noisy photo-sized JPEG (noise keeps the decoder honest)."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare CPU time and peak memory of the rendition engine (core.renditions) "
+        "against the previous decode-per-size pipeline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--image", help="JPEG to benchmark with (default: a synthetic photo).")
+        parser.add_argument("--megapixels", type=float, default=12, help="Size of the synthetic photo.")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options["image"]:
+            with open(options["image"], "rb") as f:
+                data = f.read()
+        else:
+            data = _sample_jpeg(options["megapixels"])
+        with Image.open(BytesIO(data)) as img:
+            self.stdout.write(f"Source: {img.size[0]}x{img.size[1]} {img.format}, {len(data) / 1e6:.1f} MB")
+
+        # each pipeline in its own process so peak RSS isn't shared between them
+        context = multiprocessing.get_context("spawn")
+        results = {}
+        for pipeline in PIPELINES:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[pipeline] = pool.submit(_measure, pipeline, data, options["repeat"]).result()
+            cpu, peak = results[pipeline]
+            self.stdout.write(f"{pipeline:>7}: {cpu * 1000:8.1f} ms CPU/image   peak +{peak:7.1f} MB")
+
+        (legacy_cpu, legacy_peak), (cpu, peak) = results["legacy"], results["engine"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Engine: {legacy_cpu / cpu:.1f}x less CPU, peak memory {peak:.1f} MB vs {legacy_peak:.1f} MB."
+        ))
+
+        # what a browser downloads for one 600px-wide image, per format
+        sizes = ", ".join(
+            f"{rendered.format.name} {len(rendered.data) / 1024:.0f} KB"
+            for rendered in render(BytesIO(data), renditions=(), ladder=(600,), formats=available_formats())
+        )
+        self.stdout.write(f"600px rendition: {sizes}")
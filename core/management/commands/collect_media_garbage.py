@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from core.models import ProductImage
+from core.storage import is_content_addressed
+
+
+def referenced_names():
+    """Every media name a FileField or a ProductImage.renditions manifest points at."""
+    names = set()
+    for model in apps.get_models():
+        file_fields = [f.attname for f in model._meta.concrete_fields if isinstance(f, models.FileField)]
+        for field in file_fields:
+            names.update(model._default_manager.exclude(**{field: ""}).exclude(**{f"{field}__isnull": True})
+                         .values_list(field, flat=True).iterator())
+    for manifest in ProductImage.objects.exclude(renditions={}).values_list("renditions", flat=True).iterator():
+        names.update(name for entries in manifest.values() for _width, name in entries)
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete content-addressed media files (core.storage) that no row references any more. "
+        "Files younger than --grace-hours are kept, since their rows may not be committed yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be deleted.")
+        parser.add_argument("--grace-hours", type=float, default=24)
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        cutoff = time.time() - options["grace_hours"] * 3600
+        referenced = referenced_names()
+
+        deleted = freed = 0
+        for directory, _dirs, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                if not is_content_addressed(name) or name in referenced:
+                    continue
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                if options["verbosity"] > 1 or options["dry_run"]:
+                    self.stdout.write(name)
+                if not options["dry_run"]:
+                    os.unlink(path)
+                deleted += 1
+                freed += stat.st_size
+
+        verb = "would be deleted" if options["dry_run"] else "deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{deleted} unreferenced file(s) {verb} ({freed / 1e6:.1f} MB)."
+        ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from django.db.models import Q
+
+from core.interning import encode_visits
+from core.models import Visitor
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encode existing Visitor rows: move user agent, path, referrer and "
+        "location strings into the interned lookup tables, chunk by chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        raw = Q()
+        for field in Visitor.ENCODED_FIELDS:
+            raw |= Q(**{f"{field}__isnull": False})
+
+        update_fields = list(Visitor.ENCODED_FIELDS) + list(Visitor.ENCODED_FIELDS.values())
+        pending = Visitor.objects.filter(raw).order_by("id")
+
+        last_id = 0
+        total = 0
+        while True:
+            chunk = list(pending.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+
+            encode_visits(chunk)
+            with transaction.atomic(using=router.db_for_write(Visitor)):
+                Visitor.objects.bulk_update(chunk, update_fields)
+
+            last_id = chunk[-1].id
+            total += len(chunk)
+            self.stdout.write(f"Encoded {total} visits...")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {total} visits re-encoded."))
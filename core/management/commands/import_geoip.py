@@ -0,0 +1,88 @@
+import csv
+import ipaddress
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.geoip import MAX_LABEL_BYTES, GeoIPDatabase
+
+
+def _parse_ip(value, version_hint=None):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        if version_hint == 6 or number > 0xFFFFFFFF:
+            return ipaddress.IPv6Address(number)
+        return ipaddress.IPv4Address(number)
+    return ipaddress.ip_address(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import or refresh the offline GeoIP database from a CSV of IP ranges. "
+        "Expected columns: start_ip, end_ip, country[, city]. IPs may be dotted/"
+        "colon notation or integers; a header row is skipped automatically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path", help="Path to the ranges CSV file.")
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Database file to write (defaults to settings.GEOIP_DATABASE).",
+        )
+        parser.add_argument(
+            "--ipv6-integers",
+            action="store_true",
+            help="Treat integer IP columns as IPv6 addresses.",
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"] or getattr(settings, "GEOIP_DATABASE", None)
+        if not output:
+            raise CommandError("No output path given and settings.GEOIP_DATABASE is not set.")
+
+        version_hint = 6 if options["ipv6_integers"] else None
+        ranges = []
+        skipped = 0
+
+        try:
+            with open(options["csv_path"], newline="", encoding="utf-8") as fh:
+                for line_no, row in enumerate(csv.reader(fh), start=1):
+                    if len(row) < 3 or row[0].startswith("#"):
+                        skipped += 1
+                        continue
+                    try:
+                        start = _parse_ip(row[0], version_hint)
+                        end = _parse_ip(row[1], version_hint)
+                    except ValueError:
+                        if line_no > 1:
+                            skipped += 1
+                        continue  # header row
+
+                    country = row[2].strip()
+                    city = row[3].strip() if len(row) > 3 else ""
+                    location = f"{city}, {country}" if city else (country or "Unknown")
+                    if len(location.encode("utf-8")) > MAX_LABEL_BYTES:
+                        skipped += 1  # not a real place name; the file format can't hold it either
+                        continue
+                    ranges.append((start, end, location))
+        except OSError as exc:
+            raise CommandError(f"Could not read {options['csv_path']}: {exc}")
+
+        if not ranges:
+            raise CommandError("No IP ranges found in the CSV.")
+
+        try:
+            database = GeoIPDatabase.from_ranges(ranges)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        database.save(output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(database)} ranges ({len(database.locations)} locations) into {output}."
+            + (f" Skipped {skipped} rows." if skipped else "")
+        ))
@@ -0,0 +1,162 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+
+from core.analytics import run_rollup
+from core.db_routers import ANALYTICS_DB, ANALYTICS_MODELS
+
+# interned strings: matched by digest, so source ids are remapped on the way
+LOOKUP_MODELS = {
+    "user_agent_ref": "visitoruseragent",
+    "path_ref": "visitorpath",
+    "referrer_ref": "visitorreferrer",
+    "location_ref": "visitorlocation",
+}
+# copied without their ids, which the analytics database already uses
+# for rows written since it went live
+ROW_MODELS = ["visitor", "visitorhourlyrollup", "visitordailyrollup"]
+# the legacy watermark refers to legacy ids: the rollups are rebuilt instead
+SKIPPED_MODELS = {"rollupwatermark"}
+
+
+class Command(BaseCommand):
+    help = (
+        "One-off copy of Visitor/rollup rows written to the default database before "
+        "the analytics database existed. Run `migrate --database=analytics` first. "
+        "Rows get new ids; rollups covering the copied visits are rebuilt afterwards. "
+        "With --delete-source each chunk is deleted from the source right after its "
+        "copy commits, so an interrupted run can be repeated; without it, a second "
+        "run copies everything again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="default", help="Database alias to copy from.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--delete-source", action="store_true",
+                            help="Delete the copied rows from the source database afterwards.")
+
+    def handle(self, *args, **options):
+        if {*LOOKUP_MODELS.values(), *ROW_MODELS, *SKIPPED_MODELS} != ANALYTICS_MODELS:
+            raise CommandError("move_analytics_data does not cover every model in ANALYTICS_MODELS.")
+        if options["source"] == ANALYTICS_DB:
+            raise CommandError("The source must not be the analytics database.")
+        self.source = options["source"]
+        self.chunk_size = options["chunk_size"]
+        self.delete_source = options["delete_source"]
+
+        id_maps = {ref: self._copy_lookup(model_name) for ref, model_name in LOOKUP_MODELS.items()}
+        for model_name in ROW_MODELS:
+            self._copy_rows(model_name, id_maps)
+
+        # lookup rows are only dropped once no source visit references them
+        if self.delete_source and self._source_is_empty("visitor"):
+            for model_name in LOOKUP_MODELS.values():
+                self._delete_source(model_name)
+
+        result = run_rollup()
+        self.stdout.write(
+            f"Rolled up {result['visits']} visits "
+            f"({result['hourly']} hourly / {result['daily']} daily rows rebuilt)."
+        )
+        self.stdout.write(self.style.SUCCESS("Analytics data moved."))
+
+    # -------------------------
+    # Source introspection
+    # -------------------------
+    def _source_columns(self, model):
+        """Columns of the model's table in the source database; None if it has no such table."""
+        table = model._meta.db_table
+        connection = connections[self.source]
+        if table not in connection.introspection.table_names():
+            self.stdout.write(f"{table}: not present in '{self.source}', skipped.")
+            return None
+        with connection.cursor() as cursor:
+            return {col.name for col in connection.introspection.get_table_description(cursor, table)}
+
+    def _source_rows(self, model, fields):
+        """Source rows as dicts, in pk order, `chunk_size` at a time."""
+        rows = model._base_manager.using(self.source).order_by("pk").values("pk", *fields)
+        last_pk = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)[:self.chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1]["pk"]
+            yield chunk
+
+    def _source_is_empty(self, model_name):
+        model = apps.get_model("core", model_name)
+        if model._meta.db_table not in connections[self.source].introspection.table_names():
+            return True
+        return not model._base_manager.using(self.source).exists()
+
+    def _delete_source(self, model_name, pks=None):
+        model = apps.get_model("core", model_name)
+        table = model._meta.db_table
+        try:
+            with connections[self.source].cursor() as cursor:
+                if pks is None:
+                    cursor.execute(f'DELETE FROM "{table}"')
+                else:
+                    placeholders = ", ".join(["%s"] * len(pks))
+                    cursor.execute(f'DELETE FROM "{table}" WHERE "id" IN ({placeholders})', list(pks))
+        except DatabaseError as exc:
+            self.stderr.write(f"{table}: could not delete source rows ({exc}).")
+
+    # -------------------------
+    # Copying
+    # -------------------------
+    def _copy_lookup(self, model_name):
+        """Insert missing interned values; returns {source id: analytics id}."""
+        model = apps.get_model("core", model_name)
+        if self._source_columns(model) is None:
+            return {}
+
+        id_map = {}
+        manager = model._base_manager.using(ANALYTICS_DB)
+        for chunk in self._source_rows(model, ["digest", "value"]):
+            manager.bulk_create(
+                [model(digest=row["digest"], value=row["value"]) for row in chunk], ignore_conflicts=True
+            )
+            ids = dict(manager.filter(digest__in=[row["digest"] for row in chunk]).values_list("digest", "id"))
+            id_map.update((row["pk"], ids[row["digest"]]) for row in chunk)
+        self.stdout.write(f"{model._meta.db_table}: {len(id_map)} values matched.")
+        return id_map
+
+    def _copy_rows(self, model_name, id_maps):
+        """Copy the rows under new ids, deleting each copied chunk from the source if asked to."""
+        model = apps.get_model("core", model_name)
+        table = model._meta.db_table
+        columns = self._source_columns(model)
+        if columns is None:
+            return
+
+        # The source table may predate later columns; copy what it has.
+        fields = [f.attname for f in model._meta.concrete_fields if f.column in columns and not f.primary_key]
+        derive_country = model_name == "visitor" and "country" not in columns
+        is_rollup = model_name != "visitor"
+
+        copied = 0
+        for chunk in self._source_rows(model, fields):
+            pks = [row["pk"] for row in chunk]
+            objs = []
+            for row in chunk:
+                row.pop("pk")
+                for ref, id_map in id_maps.items():
+                    if row.get(f"{ref}_id") is not None:
+                        row[f"{ref}_id"] = id_map[row[f"{ref}_id"]]
+                obj = model(**row)
+                if derive_country:
+                    obj.country = obj.location.rsplit(", ", 1)[-1] if obj.location else None
+                objs.append(obj)
+
+            with transaction.atomic(using=ANALYTICS_DB):
+                # a rollup bucket the analytics database already has is
+                # rebuilt from the raw rows by run_rollup() below
+                model._base_manager.using(ANALYTICS_DB).bulk_create(objs, ignore_conflicts=is_rollup)
+            copied += len(objs)
+            if self.delete_source:
+                # only once the copy is committed
+                self._delete_source(model_name, pks)
+
+        self.stdout.write(f"{table}: copied {copied} rows.")
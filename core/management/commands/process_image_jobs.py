@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core.image_jobs import enqueue_missing, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Render queued product image derivatives (large/medium/thumb) in a process pool. "
+        "Runs until stopped, or until the queue is empty with --once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Pool processes (default settings.IMAGE_JOB_WORKERS, else one per CPU).")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Jobs claimed per round (default twice the workers).")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument("--enqueue-missing", action="store_true",
+                            help="First queue every image that is missing a derivative.")
+
+    def handle(self, *args, **options):
+        if options["enqueue_missing"]:
+            self.stdout.write(f"Queued {enqueue_missing()} image(s) missing derivatives.")
+
+        done = run(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            once=options["once"],
+            poll_interval=options["poll_interval"],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rendered {done} image(s)."))
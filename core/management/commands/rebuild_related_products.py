@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import related
+from core.models import Product, Store
+
+
+class Command(BaseCommand):
+    help = "Recompute the related-products index (all stores, or one with --store)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", help="Subdomain of a single store to rebuild.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options["store"]:
+            store = Store.objects.filter(subdomain=options["store"]).first()
+            if store is None:
+                raise CommandError(f"No store with subdomain {options['store']!r}.")
+            products = products.filter(store=store)
+
+        count = related.rebuild(products)
+        self.stdout.write(self.style.SUCCESS(f"Related products rebuilt for {count} product(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from core_product."
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write("Full-text search needs SQLite FTS5; nothing to rebuild.")
+            return
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt."))
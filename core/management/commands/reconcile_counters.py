@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from core.models import Comment, Like, Product, recount
+
+
+class Command(BaseCommand):
+    help = "Recount Product.like_count / comment_count from the Like and Comment tables and repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report products whose counters drifted.")
+
+    def handle(self, *args, **options):
+        drifted = (
+            Product.objects.annotate(actual_likes=recount(Like), actual_comments=recount(Comment))
+            .filter(~Q(like_count=F("actual_likes")) | ~Q(comment_count=F("actual_comments")))
+            .values_list("id", "like_count", "actual_likes", "comment_count", "actual_comments")
+        )
+
+        fixed = 0
+        for pk, likes, actual_likes, comments, actual_comments in drifted.iterator():
+            self.stdout.write(
+                f"Product {pk}: likes {likes} → {actual_likes}, comments {comments} → {actual_comments}"
+            )
+            if not options["dry_run"]:
+                # recount in the UPDATE itself so writes since the scan aren't lost
+                Product.objects.filter(pk=pk).update(like_count=recount(Like), comment_count=recount(Comment))
+            fixed += 1
+
+        verb = "would be repaired" if options["dry_run"] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"{fixed} product(s) {verb}."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.analytics import purge_visits, run_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold new Visitor rows into the hourly/daily rollups, then delete raw rows "
+        "older than VISITOR_RETENTION_DAYS that are already rolled up. Safe to run "
+        "from cron as often as needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--no-purge", action="store_true", help="Only roll up, keep all raw rows.")
+        parser.add_argument("--retention-days", type=int, default=None,
+                            help="Override settings.VISITOR_RETENTION_DAYS.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Rows deleted per batch (default settings.VISITOR_PURGE_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        result = run_rollup()
+        self.stdout.write(
+            f"Rolled up {result['visits']} new visits "
+            f"({result['hourly']} hourly / {result['daily']} daily rows rebuilt)."
+        )
+
+        if options["no_purge"]:
+            return
+
+        deleted = purge_visits(options["retention_days"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} raw visits past retention."))
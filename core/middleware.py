@@ -1,42 +1,89 @@
+import uuid
+
 import requests
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.timezone import now
-from django.core.cache import cache
-from .models import Visitor
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
+from django.utils.connection import ConnectionProxy
+from django.utils.crypto import salted_hmac
+from . import geoip
+from .visitor_log import log_visit
+
+# per process: these keys only save repeated work, and there is one per visitor and page
+local_cache = ConnectionProxy(caches, "local")
 
 class VisitorTrackingMiddleware(MiddlewareMixin):
     TIMEOUT = 60  # seconds to ignore repeated hits to same page
 
-    def process_request(self, request):
-        # Ensure session exists
-        if not request.session.session_key:
-            request.session.create()
+    COOKIE_NAME = 'bz_vid'
+    COOKIE_SALT = 'core.visitor-id'
+    COOKIE_MAX_AGE = 60 * 60 * 24 * 365
 
+    def process_request(self, request):
         ip_address = self.get_client_ip(request)
-        session_key = request.session.session_key
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        visitor_id = self.get_visitor_id(request, ip_address, user_agent)
         path = request.path
         method = request.method
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
         referrer = request.META.get('HTTP_REFERER', '')
 
-        cache_key = f"visitor:{session_key}:{path}"
-        if cache.get(cache_key):
+        cache_key = f"visitor:{visitor_id}:{path}"
+        if local_cache.get(cache_key):
             return  # skip logging repeated hits within TIMEOUT
 
         location = self.get_location(ip_address)
+        store = getattr(request, 'subdomain_store', None)
 
-        Visitor.objects.create(
+        log_visit(
             ip_address=ip_address,
-            session_key=session_key,
+            session_key=visitor_id,
             user_agent=user_agent,
             url_path=path,
             method=method,
             referrer=referrer,
             location=location,
+            country=location.rsplit(', ', 1)[-1],
+            store_id=store.id if store else None,
             visit_date=now()
         )
 
-        cache.set(cache_key, True, timeout=self.TIMEOUT)
+        local_cache.set(cache_key, True, timeout=self.TIMEOUT)
+
+    def process_response(self, request, response):
+        new_id = getattr(request, '_new_visitor_id', None)
+        if new_id:
+            response.set_signed_cookie(
+                self.COOKIE_NAME, new_id,
+                salt=self.COOKIE_SALT,
+                max_age=self.COOKIE_MAX_AGE,
+                httponly=True,
+                samesite='Lax',
+            )
+            # a shared cache must never replay this visitor's cookie to others
+            patch_cache_control(response, private=True)
+        return response
+
+    def get_visitor_id(self, request, ip_address, user_agent):
+        """
+        Identify the visitor without creating a session.
+        - Logged-in users already carry a session → reuse its key.
+        - VISITOR_ID_MODE = "cookie" → signed random ID cookie (issued on first visit).
+        - VISITOR_ID_MODE = "hash" → keyed hash of IP + user agent, nothing stored client-side.
+        """
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            return session.session_key
+
+        if getattr(settings, 'VISITOR_ID_MODE', 'cookie') == 'hash':
+            return salted_hmac(self.COOKIE_SALT, f"{ip_address}|{user_agent}").hexdigest()[:32]
+
+        visitor_id = request.get_signed_cookie(self.COOKIE_NAME, default=None, salt=self.COOKIE_SALT)
+        if not visitor_id:
+            visitor_id = uuid.uuid4().hex
+            request._new_visitor_id = visitor_id
+        return visitor_id
 
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -45,9 +92,16 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
         return request.META.get('REMOTE_ADDR')
 
     def get_location(self, ip_address):
+        # Offline range database by default; the ip-api.com lookup blocks the
+        # request for up to 3s on a miss and is only used when opted into.
+        if getattr(settings, "GEOIP_BACKEND", "local") == "local":
+            return geoip.lookup(ip_address) or 'Unknown'
+        return self.get_remote_location(ip_address)
+
+    def get_remote_location(self, ip_address):
         try:
             cache_key = f"ip-location-{ip_address}"
-            location = cache.get(cache_key)
+            location = local_cache.get(cache_key)
             if location:
                 return location
 
@@ -57,7 +111,7 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
                 return 'Unknown'
 
             location = f"{data.get('city')}, {data.get('country')}"
-            cache.set(cache_key, location, timeout=86400)  # cache for 24h
+            local_cache.set(cache_key, location, timeout=86400)  # cache for 24h
             return location
         except requests.RequestException:
             return 'Unknown'
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_country(apps, schema_editor):
+    Visitor = apps.get_model('core', 'Visitor')
+    visitors = Visitor.objects.using(schema_editor.connection.alias)
+    locations = visitors.exclude(location__isnull=True).values_list('location', flat=True).distinct()
+    for location in locations:
+        visitors.filter(location=location).update(country=location.rsplit(', ', 1)[-1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_visitor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_visitor_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='visitor',
+            name='country',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='visitor',
+            name='store_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='visitor',
+            name='visit_date',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='VisitorDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_id', models.BigIntegerField(blank=True, null=True)),
+                ('path', models.CharField(blank=True, max_length=500)),
+                ('country', models.CharField(blank=True, max_length=100)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('unique_visitors', models.PositiveIntegerField(default=0)),
+                ('top_referrers', models.JSONField(blank=True, default=list)),
+                ('bucket', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='core_visito_bucket_795bbb_idx')],
+                'unique_together': {('store_id', 'bucket', 'path', 'country')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VisitorHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_id', models.BigIntegerField(blank=True, null=True)),
+                ('path', models.CharField(blank=True, max_length=500)),
+                ('country', models.CharField(blank=True, max_length=100)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('unique_visitors', models.PositiveIntegerField(default=0)),
+                ('top_referrers', models.JSONField(blank=True, default=list)),
+                ('bucket', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='core_visito_bucket_540c9b_idx')],
+                'unique_together': {('store_id', 'bucket', 'path', 'country')},
+            },
+        ),
+        migrations.RunPython(backfill_country, migrations.RunPython.noop, hints={'model_name': 'visitor'}),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_visitor_interned_strings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='custom_domain',
+            field=models.CharField(blank=True, help_text='Optional merchant domain (e.g. shop.example.com) pointed at Bazaa', max_length=253, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# SQLite FTS5 index over the searchable Product columns. External content:
+# the text lives only in core_product; core.signals keeps the index in sync.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_product_fts USING fts5(
+        title, caption, about_1, about_2, about_3, about_4,
+        content='core_product',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    "INSERT INTO core_product_fts(core_product_fts) VALUES('rebuild')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_product_fts_vocab USING fts5vocab(core_product_fts, 'row')",
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS core_product_fts_vocab",
+    "DROP TABLE IF EXISTS core_product_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return  # other backends fall back to icontains search
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_store_custom_domain'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SQL), _run(DROP_SQL), hints={'model_name': 'product'}),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def dedupe_primary_flags(apps, schema_editor):
+    """Keep only the oldest is_primary image per product so the constraint can be created."""
+    ProductImage = apps.get_model('core', 'ProductImage')
+    images = ProductImage.objects.using(schema_editor.connection.alias)
+    keep = {}
+    for pk, product_id in images.filter(is_primary=True).order_by('id').values_list('id', 'product_id'):
+        keep.setdefault(product_id, pk)
+    images.filter(is_primary=True).exclude(id__in=keep.values()).update(is_primary=False)
+
+
+def backfill_primary_image(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductImage = apps.get_model('core', 'ProductImage')
+    db = schema_editor.connection.alias
+    chosen = {}
+    for pk, product_id, is_primary in (
+        ProductImage.objects.using(db).order_by('-is_primary', 'id').values_list('id', 'product_id', 'is_primary')
+    ):
+        chosen.setdefault(product_id, pk)
+    for product_id, image_id in chosen.items():
+        Product.objects.using(db).filter(pk=product_id).update(primary_image_id=image_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.productimage'),
+        ),
+        migrations.RunPython(dedupe_primary_flags, migrations.RunPython.noop, hints={'model_name': 'productimage'}),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('product',), name='unique_primary_image_per_product'),
+        ),
+        migrations.RunPython(backfill_primary_image, migrations.RunPython.noop, hints={'model_name': 'product'}),
+    ]
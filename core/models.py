@@ -1,25 +1,154 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.conf import settings
+from django.db import DatabaseError, models, router, transaction
+from django.db.models.functions import Coalesce
 from decimal import Decimal, InvalidOperation
 import uuid
-from io import BytesIO
 from django.core.files.base import ContentFile
-from PIL import Image
+from .renditions import RENDITIONS, render as render_renditions
 from django.utils import timezone
 from datetime import timedelta
 
+# -------------------------
+# Interned visitor strings
+# -------------------------
+class InternedValue(models.Model):
+    """
+    One row per distinct string; Visitor rows point at it instead of
+    repeating the text. `digest` keeps the unique index small for long values.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    value = models.TextField()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.value
+
+
+class VisitorUserAgent(InternedValue):
+    pass
+
+
+class VisitorPath(InternedValue):
+    pass
+
+
+class VisitorReferrer(InternedValue):
+    pass
+
+
+class VisitorLocation(InternedValue):
+    pass
+
+
 class Visitor(models.Model):
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     session_key = models.CharField(max_length=40, blank=True, null=True)
+
+    # Raw strings are only set on rows not yet dictionary-encoded
+    # (see core.interning and `manage.py encode_visitors`).
     user_agent = models.TextField(blank=True, null=True)
     url_path = models.CharField(max_length=500, blank=True, null=True)
-    method = models.CharField(max_length=10, blank=True, null=True)
     referrer = models.URLField(blank=True, null=True)
     location = models.CharField(max_length=255, blank=True, null=True)
-    visit_date = models.DateTimeField(default=timezone.now)
+
+    user_agent_ref = models.ForeignKey(VisitorUserAgent, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+    path_ref = models.ForeignKey(VisitorPath, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+    referrer_ref = models.ForeignKey(VisitorReferrer, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+    location_ref = models.ForeignKey(VisitorLocation, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+
+    method = models.CharField(max_length=10, blank=True, null=True)
+    country = models.CharField(max_length=100, blank=True, null=True)
+    # plain id (not a FK) so visits survive store deletion and stay cheap to insert
+    store_id = models.BigIntegerField(blank=True, null=True)
+    visit_date = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # field name → interned FK, in the order core.interning encodes them
+    ENCODED_FIELDS = {
+        'user_agent': 'user_agent_ref',
+        'url_path': 'path_ref',
+        'referrer': 'referrer_ref',
+        'location': 'location_ref',
+    }
+
+    def decoded(self, field):
+        """Value of an encoded string field, whether or not the row is encoded yet."""
+        ref = getattr(self, self.ENCODED_FIELDS[field])
+        return ref.value if ref is not None else getattr(self, field)
+
+    @property
+    def path_value(self):
+        return self.decoded('url_path')
+
+    @property
+    def user_agent_value(self):
+        return self.decoded('user_agent')
+
+    @property
+    def referrer_value(self):
+        return self.decoded('referrer')
+
+    @property
+    def location_value(self):
+        return self.decoded('location')
 
     def __str__(self):
-        return f"{self.ip_address or 'Unknown IP'} visited {self.url_path} on {self.visit_date}"
+        return f"{self.ip_address or 'Unknown IP'} visited {self.path_value} on {self.visit_date}"
+
+
+# -------------------------
+# Visitor rollups
+# -------------------------
+class VisitorRollup(models.Model):
+    """
+    Pre-aggregated Visitor counts, rebuilt by `manage.py rollup_visitors`.
+    Rows with path == country == ALL hold the store-wide totals for the bucket.
+    """
+    ALL = "*"
+
+    store_id = models.BigIntegerField(blank=True, null=True)
+    path = models.CharField(max_length=500, blank=True)
+    country = models.CharField(max_length=100, blank=True)
+    views = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
+    top_referrers = models.JSONField(default=list, blank=True)  # [[referrer, hits], ...]
+
+    class Meta:
+        abstract = True
+
+
+class VisitorHourlyRollup(VisitorRollup):
+    bucket = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('store_id', 'bucket', 'path', 'country')
+        indexes = [models.Index(fields=['bucket'])]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} store={self.store_id} {self.path} ({self.country}): {self.views}"
+
+
+class VisitorDailyRollup(VisitorRollup):
+    bucket = models.DateField()
+
+    class Meta:
+        unique_together = ('store_id', 'bucket', 'path', 'country')
+        indexes = [models.Index(fields=['bucket'])]
+
+    def __str__(self):
+        return f"{self.bucket} store={self.store_id} {self.path} ({self.country}): {self.views}"
+
+
+class RollupWatermark(models.Model):
+    """Highest Visitor id already folded into the rollups."""
+    name = models.CharField(max_length=50, unique=True)
+    last_visitor_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_visitor_id}"
 
 
 
@@ -73,14 +202,24 @@ class Store(models.Model):
     owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='store')
     name = models.CharField(max_length=100)
     subdomain = models.CharField(max_length=50, unique=True)
+    custom_domain = models.CharField(
+        max_length=253, unique=True, blank=True, null=True,
+        help_text="Optional merchant domain (e.g. shop.example.com) pointed at Bazaa"
+    )
     description = models.TextField(blank=True)
     logo = models.ImageField(upload_to='store_logos/')
     whatsapp_number = models.CharField(max_length=20, help_text="Business WhatsApp number with country code")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Hosts are matched lowercase; keep "" out of the unique column
+        self.custom_domain = (self.custom_domain or "").strip().lower() or None
+        super().save(*args, **kwargs)
+
     def get_whatsapp_link(self, product_title=None):
         """
         Generate WhatsApp link for a product.
@@ -131,10 +270,64 @@ class Product(models.Model):
     percent_discount = models.PositiveIntegerField(blank=True, null=True)
     categories = models.ManyToManyField(Category, related_name='products', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Denormalized counters, kept current with F() updates by the Like/Comment
+    # signals (core.signals); `manage.py reconcile_counters` repairs drift.
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # The image shown on cards: the is_primary image, else the oldest one.
+    # Kept current by the ProductImage signals in core.signals.
+    primary_image = models.ForeignKey(
+        'ProductImage', on_delete=models.SET_NULL, related_name='+', blank=True, null=True, editable=False
+    )
+
+    COUNTER_FIELDS = ('like_count', 'comment_count')
+    # written only by core.signals, never by a save() of a possibly stale instance
+    SIGNAL_MAINTAINED_FIELDS = (*COUNTER_FIELDS, 'primary_image')
+
+    class Meta:
+        # keyset pagination of storefront listings (core.pagination)
+        indexes = [
+            models.Index(fields=['store', 'is_active', 'created_at']),
+            models.Index(fields=['store', 'is_active', 'price']),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.store.name})"
 
+    def save(self, *args, **kwargs):
+        # percent_discount is derived from the prices at write time, never on read
+        self.calculate_discount()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+            if {'price', 'was_price'} & set(update_fields):
+                kwargs['update_fields'].add('percent_discount')
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # never write back columns the signals may have moved since this instance was loaded
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.SIGNAL_MAINTAINED_FIELDS
+            ]
+            using = kwargs.get('using') or router.db_for_write(Product, instance=self)
+            try:
+                # a savepoint, so a missing row doesn't break the caller's transaction
+                with transaction.atomic(using=using):
+                    super().save(*args, **kwargs)
+            except DatabaseError:
+                if Product.objects.using(using).filter(pk=self.pk).exists():
+                    raise
+                # the row was deleted meanwhile (taking its images, likes and
+                # comments with it): insert it, as a plain save() would
+                del kwargs['update_fields']
+                self.primary_image = None
+                self.like_count = self.comment_count = 0
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+
     def calculate_discount(self):
         """Calculate percent discount if was_price and price are set."""
 
@@ -160,23 +353,8 @@ class Product(models.Model):
 
 
 
-def _unique_name(suffix):
-    return f"{uuid.uuid4().hex}_{suffix}.jpg"
-
-
-def _resize_and_save(uploaded_image, size):
-    if not uploaded_image:
-        return None, None
-
-    uploaded_image.open()
-    img = Image.open(uploaded_image).convert("RGB")
-    img.thumbnail(size, Image.Resampling.LANCZOS)
-
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG", quality=88, optimize=True)
-    buffer.seek(0)
-
-    return _unique_name(suffix=f"{size[0]}x{size[1]}"), ContentFile(buffer.read())
+def _unique_name(suffix, extension="jpg"):
+    return f"{uuid.uuid4().hex}_{suffix}.{extension}"
 
 
 class ProductImage(models.Model):
@@ -189,13 +367,25 @@ class ProductImage(models.Model):
     image_large = models.ImageField(upload_to="store_products/", blank=True, null=True)
     image_medium = models.ImageField(upload_to="store_products/", blank=True, null=True)
     image_thumb = models.ImageField(upload_to="store_products/", blank=True, null=True)
+    # every format × width for srcset: {"webp": [[width, storage name], ...], ...}, narrowest first
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
-    LARGE = (1200, 1200)
-    MEDIUM = (600, 600)
-    THUMB = (300, 300)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(is_primary=True), name='unique_primary_image_per_product'
+            ),
+        ]
+        indexes = [models.Index(fields=['image'])]  # finding renditions of identical uploads
+
+    # one field per rendition (core.renditions.RENDITIONS)
+    DERIVED_FIELDS = [rendition.field for rendition in RENDITIONS]
+    # everything _generate_resized() writes
+    OUTPUT_FIELDS = [*DERIVED_FIELDS, "renditions"]
 
     def save(self, *args, **kwargs):
         new_upload = False
@@ -208,34 +398,138 @@ class ProductImage(models.Model):
             old = ProductImage.objects.get(pk=self.pk)
             if old.image != self.image:
                 new_upload = True
+                # stale derivatives would show the old photo; thumb_url etc. fall back to the original
+                self._clear_derived()
 
         super().save(*args, **kwargs)
 
         if new_upload:
-            self._generate_resized()
-            super().save(update_fields=["image_large", "image_medium", "image_thumb"])
+            if self._reuse_renditions():
+                super().save(update_fields=self.OUTPUT_FIELDS)
+            elif getattr(settings, "IMAGE_DERIVATIVE_MODE", "queued") == "sync":
+                self._generate_resized()
+                super().save(update_fields=self.OUTPUT_FIELDS)
+            else:
+                # `manage.py process_image_jobs` renders them (core.image_jobs)
+                ImageJob.objects.create(image=self)
+
+    def _clear_derived(self):
+        names = {name for entries in (self.renditions or {}).values() for _width, name in entries}
+        for field in self.DERIVED_FIELDS:
+            file = getattr(self, field)
+            if file:
+                names.discard(file.name)
+                file.delete(save=False)
+            setattr(self, field, None)
+        for name in names:
+            self.image.storage.delete(name)
+        self.renditions = {}
+
+    def _reuse_renditions(self):
+        """
+        Copy the derivatives of an already rendered image with the same
+        original. With content-addressed storage (core.storage) identical
+        uploads share a name, so this skips resizing them again.
+        """
+        if not self.image:
+            return False
+        twin = (
+            ProductImage.objects.filter(image=self.image.name).exclude(pk=self.pk).exclude(renditions={})
+            .only(*self.OUTPUT_FIELDS).first()
+        )
+        if twin is None:
+            return False
+        for field in self.OUTPUT_FIELDS:
+            setattr(self, field, getattr(twin, field))
+        storage = self.image.storage
+        if hasattr(storage, "touch"):
+            # shared with the twin, which may be deleted before this row is committed
+            for entries in self.renditions.values():
+                for _width, name in entries:
+                    storage.touch(name)
+        return True
 
     def _generate_resized(self):
         # wipe old derived files if replacing
-        if self.image_large:
-            self.image_large.delete(save=False)
-        if self.image_medium:
-            self.image_medium.delete(save=False)
-        if self.image_thumb:
-            self.image_thumb.delete(save=False)
+        self._clear_derived()
+        if not self.image or self._reuse_renditions():
+            return
+
+        # decode once, then cascade down through every size and format
+        self.image.open()
+        manifest = {}
+        for rendered in render_renditions(self.image):
+            name = _unique_name(suffix=rendered.suffix, extension=rendered.format.extension)
+            if rendered.field:
+                file = getattr(self, rendered.field)
+                file.save(name, ContentFile(rendered.data), save=False)
+                name = file.name
+            else:
+                name = self.image.storage.save(
+                    self.image.field.generate_filename(self, name), ContentFile(rendered.data)
+                )
+            manifest.setdefault(rendered.format.name, []).append([rendered.size[0], name])
+        for entries in manifest.values():
+            entries.sort()
+        self.renditions = manifest
+
+    # derivatives are empty until the image job has run: fall back to the original
+    @property
+    def thumb_url(self):
+        return (self.image_thumb or self.image).url
+
+    @property
+    def medium_url(self):
+        return (self.image_medium or self.image).url
+
+    def __str__(self):
+        return f"Image for {self.product.title}"
 
-        # generate fresh
-        name, content = _resize_and_save(self.image, self.LARGE)
-        self.image_large.save(name, content, save=False)
 
-        name, content = _resize_and_save(self.image, self.MEDIUM)
-        self.image_medium.save(name, content, save=False)
+class ImageJob(models.Model):
+    """
+    Derivative generation waiting for `manage.py process_image_jobs`
+    (core.image_jobs). Finished jobs are deleted; failed ones are kept
+    with their error once IMAGE_JOB_MAX_ATTEMPTS is reached.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (FAILED, "Failed")]
+
+    image = models.ForeignKey(ProductImage, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
 
-        name, content = _resize_and_save(self.image, self.THUMB)
-        self.image_thumb.save(name, content, save=False)
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
 
     def __str__(self):
-        return f"Image for {self.product.title}"
+        return f"Image job {self.pk} ({self.status}) for image {self.image_id}"
+
+
+# -------------------------
+# Related products
+# -------------------------
+class RelatedProduct(models.Model):
+    """
+    Precomputed "you may also like" list: the best-ranked active products of
+    the same store by shared categories, then recency. Maintained by
+    core.related (signals + `manage.py rebuild_related_products`).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_of')
+    shared_categories = models.PositiveSmallIntegerField(default=0)
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('product', 'rank')  # also the index the detail page reads
+
+    def __str__(self):
+        return f"{self.product_id} → {self.related_id} (#{self.rank})"
 
 
 # -------------------------
@@ -266,12 +560,22 @@ class Like(models.Model):
         return f"Like on {self.product.title} from {self.user_ip}"
 
 
+def recount(model):
+    """Expression recounting a product's `model` rows (Like or Comment), for Product.objects.update()."""
+    counts = (
+        model.objects.filter(product=models.OuterRef("pk"))
+        .order_by().values("product").annotate(n=models.Count("id")).values("n")
+    )
+    return Coalesce(models.Subquery(counts, output_field=models.IntegerField()), models.Value(0))
+
+
 class Announcement_Store(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='announcements')
     title = models.CharField(max_length=150, blank=True, null=True)
     message = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Announcement for {self.store.name}: {self.title}"
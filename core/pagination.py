@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for storefront product listings.
+
+Instead of COUNT(*) + OFFSET, each page continues from the sort key and id
+of the last product already shown, so "load more" is one range query on
+the (store, sort column) index no matter how deep the shopper scrolls.
+Cursors are signed, so they can't be forged to read other stores' rows or
+inject arbitrary filter values.
+
+Search results sorted by relevance are already a bounded, ranked id list
+(see core.search); those cursors are simply an offset into that list.
+"""
+from dataclasses import dataclass
+
+from django.core import signing
+from django.db.models import F, Q
+
+CURSOR_SALT = "core.keyset-cursor"
+
+# sort name → (column, descending). Ties are broken on id in the same direction.
+SORTS = {
+    "newest": ("created_at", True),
+    "price_low": ("price", False),
+    "price_high": ("price", True),
+}
+DEFAULT_SORT = "newest"
+RELEVANCE = "relevance"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(sort, position):
+    return signing.dumps([sort, position], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, sort):
+    """Position stored in `cursor`; it must have been issued for the same sort."""
+    try:
+        cursor_sort, position = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError) as exc:
+        raise InvalidCursor(str(exc)) from exc
+    if cursor_sort != sort:
+        raise InvalidCursor("cursor was issued for a different sort")
+    return position
+
+
+# -------------------------
+# Column sorts
+# -------------------------
+def _ordering(column, descending):
+    key = F(column).desc(nulls_last=True) if descending else F(column).asc(nulls_last=True)
+    return key, "-id" if descending else "id"
+
+
+def _after(column, descending, value, last_id):
+    """Rows strictly after (value, last_id) in ORDER BY column [DESC] NULLS LAST, id [DESC]."""
+    beyond = "lt" if descending else "gt"
+    if value is None:
+        # already in the trailing NULL block: only ids remain to compare
+        return Q(**{f"{column}__isnull": True, f"id__{beyond}": last_id})
+    return (
+        Q(**{f"{column}__{beyond}": value})
+        | Q(**{column: value, f"id__{beyond}": last_id})
+        | Q(**{f"{column}__isnull": True})
+    )
+
+
+def paginate_keyset(queryset, sort=DEFAULT_SORT, cursor=None, per_page=12):
+    """One page of `queryset` in `sort` order, starting after `cursor`."""
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    column, descending = SORTS[sort]
+    field = queryset.model._meta.get_field(column)
+
+    if cursor:
+        raw_value, last_id = decode_cursor(cursor, sort)
+        try:
+            value = None if raw_value is None else field.to_python(raw_value)
+        except Exception as exc:
+            raise InvalidCursor(str(exc)) from exc
+        queryset = queryset.filter(_after(column, descending, value, last_id))
+
+    rows = list(queryset.order_by(*_ordering(column, descending))[: per_page + 1])
+    page = KeysetPage(rows[:per_page])
+    if len(rows) > per_page:
+        last = page.items[-1]
+        value = getattr(last, column)
+        page.next_cursor = encode_cursor(sort, [None if value is None else field.value_to_string(last), last.id])
+    return page
+
+
+# -------------------------
+# Relevance (ranked search results)
+# -------------------------
+def paginate_ranked(queryset, ranked_ids, cursor=None, per_page=12):
+    """One page of `queryset` in the order of `ranked_ids`, starting at the cursor's offset."""
+    offset = decode_cursor(cursor, RELEVANCE) if cursor else 0
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor("bad offset")
+
+    # other filters (category, …) may drop some of the ranked ids
+    allowed = set(queryset.filter(id__in=ranked_ids).values_list("id", flat=True))
+    ordered = [pk for pk in ranked_ids if pk in allowed]
+
+    page_ids = ordered[offset : offset + per_page]
+    by_id = {p.id: p for p in queryset.filter(id__in=page_ids)}
+    page = KeysetPage([by_id[pk] for pk in page_ids if pk in by_id])
+    if offset + per_page < len(ordered):
+        page.next_cursor = encode_cursor(RELEVANCE, offset + per_page)
+    return page
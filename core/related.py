@@ -0,0 +1,126 @@
+"""
+Related-products index.
+
+Each product keeps up to MAX_RELATED rows in RelatedProduct: active products
+of the same store ranked by how many categories they share with it, newest
+first on ties. Rows are recomputed for the products an edit can affect —
+the product itself plus everything sharing a category with it or currently
+listing it — after the surrounding transaction commits (see core.signals).
+Rewriting a product's list bumps its store's content version, so cached
+"related" fragments and ETags rendered meanwhile are retired.
+
+With RELATED_REFRESH_MODE = "buffered" that recompute runs on a background
+thread (core.write_buffer): an edit to a product in a big category costs
+the request a couple of queries to find who is affected, not one
+transaction per affected product. Ids queued together are recomputed once.
+Ids lost with the process (or dropped from a full queue) only leave related
+lists stale until the next edit or `manage.py rebuild_related_products`.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Product, RelatedProduct
+from .store_cache import bump_content_version
+from .write_buffer import BufferedWriter
+
+MAX_RELATED = 4
+
+ProductCategory = Product.categories.through
+
+
+def compute_related(product_id):
+    """[(related_id, shared_categories), ...] best first."""
+    product = Product.objects.filter(pk=product_id).values("store_id", "is_active").first()
+    if product is None or not product["is_active"]:
+        return []
+
+    category_ids = ProductCategory.objects.filter(product_id=product_id).values("category_id")
+    rows = (
+        ProductCategory.objects
+        .filter(category_id__in=category_ids, product__store_id=product["store_id"], product__is_active=True)
+        .exclude(product_id=product_id)
+        .values("product_id")
+        .annotate(shared=Count("category_id"))
+        .order_by("-shared", "-product__created_at", "-product_id")[:MAX_RELATED]
+    )
+    return [(row["product_id"], row["shared"]) for row in rows]
+
+
+def refresh_related(product_ids):
+    """Recompute the related rows of `product_ids` and bump the stores whose lists changed."""
+    changed_stores = set()
+    for product_id in set(product_ids):
+        related = compute_related(product_id)
+        with transaction.atomic():
+            current = list(
+                RelatedProduct.objects.filter(product_id=product_id).order_by("rank")
+                .values_list("related_id", "shared_categories")
+            )
+            if current == related:
+                continue
+            RelatedProduct.objects.filter(product_id=product_id).delete()
+            store_id = Product.objects.filter(pk=product_id).values_list("store_id", flat=True).first()
+            if store_id is None:
+                continue  # deleted meanwhile; its page is gone too
+            RelatedProduct.objects.bulk_create([
+                RelatedProduct(product_id=product_id, related_id=related_id, shared_categories=shared, rank=rank)
+                for rank, (related_id, shared) in enumerate(related)
+            ])
+        changed_stores.add(store_id)
+
+    # the m2m/save signals bumped the version before this ran, so pages rendered
+    # in between cached the old list under the new version
+    for store_id in changed_stores:
+        bump_content_version(store_id)
+
+
+def affected_by(product_ids=(), category_ids=()):
+    """Products whose related list may change when these products/categories change."""
+    product_ids = set(product_ids)
+    category_ids = set(category_ids) | set(
+        ProductCategory.objects.filter(product_id__in=product_ids).values_list("category_id", flat=True)
+    )
+    affected = set(product_ids)
+    affected |= set(ProductCategory.objects.filter(category_id__in=category_ids).values_list("product_id", flat=True))
+    affected |= set(RelatedProduct.objects.filter(related_id__in=product_ids).values_list("product_id", flat=True))
+    return affected
+
+
+def get_writer():
+    """Return the process-wide refresh queue, creating it on first use."""
+    return BufferedWriter.singleton(
+        "related-refresh", refresh_related, "RELATED_REFRESH",
+        batch_size=200, flush_interval=1.0, max_queue_size=50000,
+    )
+
+
+def _refresh_soon(product_ids):
+    if getattr(settings, "RELATED_REFRESH_MODE", "buffered") != "buffered":
+        refresh_related(product_ids)
+        return
+    writer = get_writer()
+    for product_id in product_ids:
+        writer.put(product_id)
+
+
+def refresh_on_commit(product_ids):
+    product_ids = set(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: _refresh_soon(product_ids))
+
+
+def rebuild(queryset=None, chunk_size=1000):
+    """Recompute every product's related rows; returns how many products were processed."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    count = 0
+    chunk = []
+    for product_id in queryset.values_list("id", flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(product_id)
+        if len(chunk) == chunk_size:
+            refresh_related(chunk)  # one version bump per changed store and chunk
+            count += len(chunk)
+            chunk = []
+    refresh_related(chunk)
+    return count + len(chunk)
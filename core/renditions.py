@@ -0,0 +1,191 @@
+"""
+Product image renditions.
+
+What gets rendered is declared here: FORMATS (AVIF when this Pillow build
+has it, WebP, JPEG) at every bounding box of WIDTH_LADDER for srcset, plus
+the fixed JPEG derivatives in RENDITIONS that have their own ProductImage
+fields. render() decodes the original once — for JPEGs at a reduced DCT
+scale via draft(), just big enough for the largest box — applies the EXIF
+orientation, then downsamples in cascade (largest box first), each step
+starting from the previous, much smaller result. Outputs are encoded
+without EXIF (camera, GPS) but keep the ICC profile.
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import ExifTags, Image, ImageOps, features
+
+
+@dataclass(frozen=True)
+class Format:
+    name: str
+    mime: str
+    extension: str
+    quality: int
+    options: dict = field(default_factory=dict, hash=False)  # extra Image.save() arguments
+
+
+# best first: negotiation and <picture> sources follow this order
+FORMATS = (
+    Format("avif", "image/avif", "avif", 50, {"speed": 6}),
+    Format("webp", "image/webp", "webp", 80, {"method": 4}),
+    Format("jpeg", "image/jpeg", "jpg", 88, {"optimize": True}),
+)
+FALLBACK_FORMAT = "jpeg"
+
+
+@dataclass(frozen=True)
+class Rendition:
+    field: str          # ProductImage field the JPEG is stored in
+    size: tuple         # bounding box; aspect ratio is kept, never upscaled
+
+    @property
+    def suffix(self):
+        return f"{self.size[0]}x{self.size[1]}"
+
+
+RENDITIONS = (
+    Rendition("image_large", (1200, 1200)),
+    Rendition("image_medium", (600, 600)),
+    Rendition("image_thumb", (300, 300)),
+)
+
+# square bounding boxes rendered in every format for srcset
+WIDTH_LADDER = (1200, 900, 600, 300)
+
+# decode at no less than this multiple of the largest box so the final
+# LANCZOS pass still has detail to work with (as Image.thumbnail does)
+DRAFT_REDUCING_GAP = 2.0
+
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}  # EXIF orientations that swap width and height
+
+
+@dataclass
+class Rendered:
+    format: Format
+    box: tuple
+    size: tuple         # actual pixel size
+    data: bytes
+    field: str = None   # set for the JPEGs of RENDITIONS
+
+    @property
+    def suffix(self):
+        return f"{self.box[0]}x{self.box[1]}"
+
+
+@lru_cache(maxsize=None)
+def available_formats():
+    """FORMATS this Pillow build can encode."""
+    return tuple(fmt for fmt in FORMATS if fmt.name == FALLBACK_FORMAT or features.check(fmt.name))
+
+
+def _fit(size, box):
+    """`size` scaled down to fit in `box`, keeping the aspect ratio."""
+    scale = min(box[0] / size[0], box[1] / size[1], 1)
+    return max(round(size[0] * scale), 1), max(round(size[1] * scale), 1)
+
+
+def _decode(file, box):
+    """Open `file` once, decoded no larger than needed for `box`, upright and in RGB."""
+    img = Image.open(file)
+    if img.format == "JPEG":
+        width, height = img.size
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+        stored_box = (box[1], box[0]) if orientation in _TRANSPOSED_ORIENTATIONS else box
+        target = _fit((width, height), stored_box)
+        img.draft("RGB", (int(target[0] * DRAFT_REDUCING_GAP), int(target[1] * DRAFT_REDUCING_GAP)))
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, "white")
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+    return img
+
+
+def _encode(img, fmt, icc_profile):
+    buffer = BytesIO()
+    img.save(buffer, format=fmt.name.upper(), quality=fmt.quality, icc_profile=icc_profile, **fmt.options)
+    return buffer.getvalue()
+
+
+def render(file, renditions=RENDITIONS, ladder=WIDTH_LADDER, formats=None):
+    """[Rendered, ...]: every format at every ladder box, and the JPEG of each rendition."""
+    formats = available_formats() if formats is None else formats
+    fields = {rendition.size: rendition.field for rendition in renditions}
+    boxes = sorted({*((width, width) for width in ladder), *fields}, key=lambda b: b[0] * b[1], reverse=True)
+
+    file.seek(0)
+    img = _decode(file, boxes[0])
+    icc_profile = img.info.get("icc_profile")
+
+    rendered = []
+    previous = None
+    for box in boxes:
+        size = _fit(img.size, box)
+        if size != img.size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        for fmt in formats:
+            field_name = fields.get(box) if fmt.name == FALLBACK_FORMAT else None
+            if img.size == previous and field_name is None:
+                continue  # the original is smaller than this box too: same pixels again
+            rendered.append(Rendered(fmt, box, img.size, _encode(img, fmt, icc_profile), field_name))
+        previous = img.size
+    return rendered
+
+
+def render_width(file, width, fmt):
+    """One image at most `width` px wide (any height) in `fmt`, for on-demand resizing."""
+    box = (width, 10 ** 6)
+    file.seek(0)
+    img = _decode(file, box)
+    size = _fit(img.size, box)
+    if size != img.size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    return _encode(img, fmt, img.info.get("icc_profile"))
+
+
+# -------------------------
+# Choosing a rendition
+# -------------------------
+def accepted_formats(accept):
+    """Names of FORMATS listed explicitly (q > 0) in an Accept header, plus the fallback."""
+    accepted = {FALLBACK_FORMAT}
+    for part in (accept or "").split(","):
+        mime, *params = part.split(";")
+        if _quality(params) <= 0:
+            continue
+        accepted.update(fmt.name for fmt in FORMATS if fmt.mime == mime.strip().lower())
+    return accepted
+
+
+def _quality(params):
+    """The q value among an Accept entry's parameters (1 when absent, 0 when malformed)."""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0
+    return 1
+
+
+def pick(manifest, accept, width):
+    """
+    (format, storage name) of the best rendition in a ProductImage.renditions
+    manifest: the preferred accepted format, smallest variant at least
+    `width` wide (else the largest). None if the manifest is empty.
+    """
+    accepted = accepted_formats(accept)
+    for fmt in FORMATS:
+        entries = manifest.get(fmt.name) if fmt.name in accepted else None
+        if entries:
+            wide_enough = [entry for entry in entries if entry[0] >= width]
+            return fmt, (wide_enough[0] if wide_enough else entries[-1])[1]
+    return None
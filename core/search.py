@@ -0,0 +1,176 @@
+"""
+Product full-text search (SQLite FTS5).
+
+`core_product_fts` is an external-content FTS5 table over core_product's
+title, caption and about_1..4 columns (see migration 0016). The signal
+handlers in core.signals keep it in sync; `manage.py rebuild_search_index`
+repairs it after bulk `.update()`s that bypass signals.
+
+Queries are prefix-matched per word and ranked with bm25 (title weighted
+highest). When nothing matches, misspelt words are swapped for close terms
+from the index vocabulary and the search is retried. The match is applied
+to listing querysets in SQL (filter_matching), so category, price and other
+filters combine with it before any result cap (ranked_ids).
+"""
+import difflib
+import re
+
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = "core_product_fts"
+VOCAB_TABLE = "core_product_fts_vocab"
+INDEXED_COLUMNS = ("title", "caption", "about_1", "about_2", "about_3", "about_4")
+# bm25 weight per indexed column, same order as INDEXED_COLUMNS
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 1.0, 1.0, 1.0)
+
+MAX_RESULTS = 500
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _connection():
+    return connections[router.db_for_write(Product)]
+
+
+def is_available():
+    return _connection().vendor == "sqlite"
+
+
+# -------------------------
+# Index maintenance
+# -------------------------
+_COLUMNS = ", ".join(INDEXED_COLUMNS)
+
+
+def index_remove(product_id):
+    """Drop a product from the index. Must run while its old row is still in core_product."""
+    if not is_available():
+        return
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) "
+            f"SELECT 'delete', id, {_COLUMNS} FROM core_product WHERE id = %s",
+            [product_id],
+        )
+
+
+def index_add(product_id):
+    """Index the current row of a product."""
+    if not is_available():
+        return
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) "
+            f"SELECT id, {_COLUMNS} FROM core_product WHERE id = %s",
+            [product_id],
+        )
+
+
+def rebuild_index():
+    if not is_available():
+        return
+    with _connection().cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('optimize')")
+
+
+# -------------------------
+# Querying
+# -------------------------
+def _tokens(text):
+    return [token.lower() for token in _WORD_RE.findall(text)][:8]
+
+
+def _match_expression(groups):
+    """[[alt, ...], ...] → FTS5 query: every group must match, any alternative per group."""
+    parts = []
+    for alternatives in groups:
+        terms = " OR ".join('"%s"*' % term.replace('"', '""') for term in alternatives)
+        parts.append(f"({terms})" if len(alternatives) > 1 else terms)
+    return " AND ".join(parts)
+
+
+def _has_match(cursor, match, store_id):
+    cursor.execute(
+        f"SELECT 1 FROM {FTS_TABLE} f "
+        f"JOIN core_product p ON p.id = f.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s AND p.store_id = %s AND p.is_active LIMIT 1",
+        [match, store_id],
+    )
+    return cursor.fetchone() is not None
+
+
+def _corrections(cursor, token):
+    """Indexed terms close to a token that has no prefix match of its own."""
+    cursor.execute(
+        f"SELECT 1 FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s LIMIT 1",
+        [token, token + "\uffff"],
+    )
+    if cursor.fetchone():
+        return [token]
+
+    cursor.execute(
+        f"SELECT term FROM {VOCAB_TABLE} "
+        f"WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s "
+        f"ORDER BY doc DESC LIMIT 2000",
+        [token[0], token[0] + "\uffff", max(1, len(token) - 2), len(token) + 2],
+    )
+    candidates = [row[0] for row in cursor.fetchall()]
+    return difflib.get_close_matches(token, candidates, n=3, cutoff=0.7)
+
+
+def match_expression(store, text):
+    """
+    FTS5 query for `text` within `store`'s active products: its words as
+    prefixes, or their closest indexed spellings when those match nothing.
+    "" when nothing can match; None when full-text search isn't available.
+    """
+    if not is_available():
+        return None
+
+    tokens = _tokens(text)
+    if not tokens:
+        return ""
+
+    with _connection().cursor() as cursor:
+        match = _match_expression([[t] for t in tokens])
+        if _has_match(cursor, match, store.id):
+            return match
+
+        # typo tolerance: retry with the closest indexed spellings
+        groups = []
+        for token in tokens:
+            alternatives = _corrections(cursor, token)
+            if not alternatives:
+                return ""
+            groups.append(alternatives)
+        return _match_expression(groups)
+
+
+def filter_matching(queryset, match):
+    """`queryset` narrowed to products matching a match_expression(), in the database."""
+    if not match:
+        return queryset.none()
+    return queryset.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+
+
+def ranked_ids(queryset, match, limit=MAX_RESULTS):
+    """
+    Ids of `queryset` matching `match`, best first (bm25, title weighted
+    highest). The queryset's filters apply before the `limit`, so a narrow
+    listing of a store with many matches still gets all of its results.
+    """
+    if not match:
+        return []
+    ids_sql, params = queryset.order_by().values("id").query.sql_with_params()
+    weights = ", ".join(str(w) for w in COLUMN_WEIGHTS)
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({ids_sql}) "
+            f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s",
+            [match, *params, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,178 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import related, search
+from .models import Announcement_Store, Category, Comment, Like, Product, ProductImage, Store
+from .store_cache import bump_content_version, domain_index, invalidate_subdomain
+
+
+# -------------------------
+# Store resolution cache
+# -------------------------
+@receiver(pre_save, sender=Store)
+def remember_old_hosts(sender, instance, **kwargs):
+    """Keep the pre-save subdomain/custom domain so a rename also drops the old entries."""
+    if instance.pk:
+        instance._old_hosts = (
+            Store.objects.filter(pk=instance.pk).values_list("subdomain", "custom_domain").first()
+        )
+
+
+@receiver(post_save, sender=Store)
+def invalidate_store_cache_on_save(sender, instance, **kwargs):
+    invalidate_subdomain(instance.subdomain)  # may hold a negative entry
+    old_subdomain, old_domain = getattr(instance, "_old_hosts", None) or (None, None)
+    if old_subdomain and old_subdomain != instance.subdomain:
+        invalidate_subdomain(old_subdomain)
+    if instance.custom_domain or old_domain:
+        domain_index.invalidate()
+    bump_content_version(instance.pk)
+
+
+@receiver(post_delete, sender=Store)
+def invalidate_store_cache_on_delete(sender, instance, **kwargs):
+    invalidate_subdomain(instance.subdomain)
+    if instance.custom_domain:
+        domain_index.invalidate()
+
+
+# -------------------------
+# Product search index
+# -------------------------
+@receiver(pre_save, sender=Product)
+def unindex_product_before_save(sender, instance, **kwargs):
+    # external-content FTS needs the old values to remove a row
+    if instance.pk:
+        search.index_remove(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product_after_save(sender, instance, **kwargs):
+    search.index_add(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_product_before_delete(sender, instance, **kwargs):
+    search.index_remove(instance.pk)
+
+
+# -------------------------
+# Storefront fragment cache
+# -------------------------
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Announcement_Store)
+@receiver(post_delete, sender=Announcement_Store)
+def bump_store_content_version(sender, instance, **kwargs):
+    bump_content_version(instance.store_id)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def bump_content_version_for_image(sender, instance, **kwargs):
+    store_id = Product.objects.filter(pk=instance.product_id).values_list("store_id", flat=True).first()
+    bump_content_version(store_id)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def bump_content_version_for_categories(sender, instance, action, **kwargs):
+    # instance is a Product or a Category, depending on which side changed
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_content_version(instance.store_id)
+
+
+# -------------------------
+# Product like/comment counters
+# -------------------------
+_COUNTERS = {Like: "like_count", Comment: "comment_count"}
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+def increment_product_counter(sender, instance, created, **kwargs):
+    if created:
+        field = _COUNTERS[sender]
+        Product.objects.filter(pk=instance.product_id).update(**{field: F(field) + 1})
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Comment)
+def decrement_product_counter(sender, instance, **kwargs):
+    field = _COUNTERS[sender]
+    # the > 0 guard keeps a drifted counter from going negative
+    Product.objects.filter(pk=instance.product_id, **{f"{field}__gt": 0}).update(**{field: F(field) - 1})
+
+
+# -------------------------
+# Related-products index
+# -------------------------
+def _affected_by_category_change(instance, reverse, pk_set):
+    if reverse:  # instance is a Category, pk_set holds product ids
+        return related.affected_by(pk_set or (), [instance.pk])
+    return related.affected_by([instance.pk], pk_set or ())
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def refresh_related_for_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("pre_remove", "pre_clear"):
+        # the old memberships are gone after the change; remember who they touched
+        instance._related_affected = _affected_by_category_change(instance, reverse, pk_set)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        affected = _affected_by_category_change(instance, reverse, pk_set)
+        related.refresh_on_commit(affected | getattr(instance, "_related_affected", set()))
+        instance._related_affected = set()
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_active_state(sender, instance, **kwargs):
+    instance._old_is_active = (
+        Product.objects.filter(pk=instance.pk).values_list("is_active", flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Product)
+def refresh_related_on_activation(sender, instance, created, **kwargs):
+    # a new product has no categories yet; m2m_changed handles it once it does
+    if not created and instance._old_is_active != instance.is_active:
+        related.refresh_on_commit(related.affected_by([instance.pk]))
+
+
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=Category)
+def remember_related_before_delete(sender, instance, **kwargs):
+    if sender is Product:
+        instance._related_affected = related.affected_by([instance.pk]) - {instance.pk}
+    else:
+        instance._related_affected = related.affected_by(category_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def refresh_related_after_delete(sender, instance, **kwargs):
+    related.refresh_on_commit(getattr(instance, "_related_affected", ()))
+
+
+# -------------------------
+# Product.primary_image
+# -------------------------
+@receiver(pre_save, sender=ProductImage)
+def clear_other_primary_flags(sender, instance, **kwargs):
+    # at most one is_primary image per product (enforced by a unique constraint)
+    if instance.is_primary:
+        ProductImage.objects.filter(product_id=instance.product_id, is_primary=True) \
+            .exclude(pk=instance.pk).update(is_primary=False)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_primary_image(sender, instance, **kwargs):
+    primary = (
+        ProductImage.objects.filter(product_id=instance.product_id)
+        .order_by("-is_primary", "id").values_list("id", flat=True).first()
+    )
+    Product.objects.filter(pk=instance.product_id).exclude(primary_image_id=primary) \
+        .update(primary_image_id=primary)
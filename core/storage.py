@@ -0,0 +1,105 @@
+"""
+Content-addressed media storage.
+
+Files are named by the SHA-256 of their bytes — "<upload_to>/ab/abcdef….jpg"
+— so identical uploads (the same photo on several product variants) are
+stored once, and a file's URL changes whenever its content does. That
+makes every hashed URL safe to cache forever: media_urlpatterns() serves
+them with `Cache-Control: public, max-age=31536000, immutable` (in
+production, give the web server's media location the same header for
+names matching CONTENT_ADDRESSED_NAME).
+
+Because a file may be shared by several rows, delete() leaves it on disk;
+`manage.py collect_media_garbage` removes hashed files nothing references.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.urls import re_path
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+CONTENT_ADDRESSED_NAME = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED_NAME.search(name or ""))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # the final name comes from the content in _save(); never add a suffix
+        return name
+
+    def _save(self, name, content):
+        digest = content_hash(content)
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        if self.exists(name):
+            # same bytes already stored; the new reference is not committed
+            # yet, so restart the collect_media_garbage grace period
+            self.touch(name)
+            return name
+
+        # write to a temp file and rename: concurrent identical uploads
+        # just replace each other with the same bytes
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp, self.file_permissions_mode)
+            os.replace(tmp, full_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return name
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, name):
+        """Shared by every row with the same content: left for collect_media_garbage."""
+        if not is_content_addressed(name):
+            super().delete(name)
+
+
+# -------------------------
+# Serving (development, like django.conf.urls.static)
+# -------------------------
+def serve_media(request, path, document_root=None):
+    response = serve(request, path, document_root=document_root)
+    if is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+def media_urlpatterns():
+    """MEDIA_URL patterns for DEBUG; hashed files are sent as immutable."""
+    if not settings.DEBUG:
+        return []
+    prefix = settings.MEDIA_URL.lstrip("/")
+    return [
+        re_path(rf"^{re.escape(prefix)}(?P<path>.*)$", serve_media, {"document_root": settings.MEDIA_ROOT}),
+    ]
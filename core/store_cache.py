@@ -0,0 +1,211 @@
+"""
+Host → Store resolution caches.
+
+Subdomain lookups go through a small in-process LRU (short TTL, and only
+while the store's content version is unchanged), then the shared "stores"
+cache, and only then the database. Misses are cached too, so
+bots probing random subdomains don't reach the DB.
+
+Custom domains are resolved from an in-memory dict of every mapped domain,
+reloaded when the shared index version changes and at least every
+STORE_DOMAIN_INDEX_MAX_AGE seconds. Both are invalidated by the Store
+signals in core.signals.
+
+Each store also has a content version, bumped whenever its catalog or
+announcements change; storefront fragment cache keys include it, so a
+bump retires every cached fragment of that store at once.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+from .models import Store
+
+# its own alias: culling storefront fragments from "default" must never drop a version
+cache = ConnectionProxy(caches, "stores")
+
+_NOT_FOUND = "__store_not_found__"  # negative entry in the shared cache
+
+
+class LocalTTLCache:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = LocalTTLCache(
+    max_size=getattr(settings, "STORE_CACHE_LOCAL_SIZE", 1024),
+    ttl=getattr(settings, "STORE_CACHE_LOCAL_TTL", 30),
+)
+_MISS = object()
+
+
+def _cache_key(subdomain):
+    return f"store:subdomain:{subdomain}"
+
+
+def get_store_by_subdomain(subdomain):
+    """Return the Store for `subdomain`, or None if there isn't one."""
+    key = _cache_key(subdomain)
+
+    # a local copy is only used while the store's content version (bumped by
+    # Store saves in any worker) is unchanged, so no page is rendered, cached
+    # or tagged with store details this worker missed an update to
+    store, version = _local.get(key, (_MISS, None))
+    if store is None or (store is not _MISS and version == get_content_version(store.id)):
+        return store
+
+    store = cache.get(key)
+    if store is None:
+        store = Store.objects.filter(subdomain=subdomain).first()
+        if store is None:
+            cache.set(key, _NOT_FOUND, getattr(settings, "STORE_CACHE_NEGATIVE_TTL", 60))
+        else:
+            cache.set(key, store, getattr(settings, "STORE_CACHE_TTL", 300))
+
+    if store == _NOT_FOUND:
+        store = None
+
+    _local.set(key, (store, get_content_version(store.id) if store is not None else None))
+    return store
+
+
+def invalidate_subdomain(subdomain):
+    if not subdomain:
+        return
+    key = _cache_key(subdomain)
+    _local.delete(key)
+    cache.delete(key)
+
+
+# -------------------------
+# Custom domain index
+# -------------------------
+_DOMAIN_INDEX_VERSION_KEY = "store:domain-index:version"
+
+
+class CustomDomainIndex:
+    """
+    custom_domain → subdomain, held per process. Refreshed when the shared
+    index version is bumped (checked every `check_interval` seconds) and in
+    any case once it is `max_age` seconds old, for changes made without the
+    signals (queryset.update(), the shell, another host's cache).
+    """
+
+    def __init__(self, check_interval=30, max_age=300):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._domains = None
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        version = cache.get(_DOMAIN_INDEX_VERSION_KEY)
+        if version is None:
+            version = time.time_ns()
+            cache.add(_DOMAIN_INDEX_VERSION_KEY, version, None)
+            version = cache.get(_DOMAIN_INDEX_VERSION_KEY, version)
+        return version
+
+    def _refresh(self):
+        now = time.monotonic()
+        domains = self._domains
+        if domains is not None and now - self._checked_at < self.check_interval:
+            return domains
+        with self._lock:
+            self._checked_at = now
+            version = self._current_version()
+            if self._domains is None or version != self._version or now - self._loaded_at >= self.max_age:
+                self._domains = dict(
+                    Store.objects.exclude(custom_domain__isnull=True)
+                    .values_list("custom_domain", "subdomain")
+                )
+                self._version = version
+                self._loaded_at = now
+            return self._domains
+
+    def lookup(self, host):
+        """Subdomain of the store mapped to `host` (with or without www.), or None."""
+        domains = self._refresh()
+        subdomain = domains.get(host)
+        if subdomain is None and host.startswith("www."):
+            subdomain = domains.get(host[4:])
+        return subdomain
+
+    def invalidate(self):
+        cache.set(_DOMAIN_INDEX_VERSION_KEY, time.time_ns(), None)
+        with self._lock:
+            self._domains = None
+
+
+domain_index = CustomDomainIndex(
+    check_interval=getattr(settings, "STORE_CACHE_LOCAL_TTL", 30),
+    max_age=getattr(settings, "STORE_DOMAIN_INDEX_MAX_AGE", 300),
+)
+
+
+def get_store_by_custom_domain(host):
+    subdomain = domain_index.lookup(host)
+    if subdomain is None:
+        return None
+    return get_store_by_subdomain(subdomain)
+
+
+# -------------------------
+# Store content version
+# -------------------------
+def _content_version_key(store_id):
+    return f"store:content-version:{store_id}"
+
+
+def get_content_version(store_id):
+    key = _content_version_key(store_id)
+    version = cache.get(key)
+    if version is None:
+        # a timestamp, not a counter: an evicted version must not restart at a used value
+        version = time.time_ns()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_content_version(store_id):
+    if store_id:
+        cache.set(_content_version_key(store_id), time.time_ns(), None)
@@ -1,16 +1,26 @@
 from django.urls import path
 from .views import *
 from django.conf import settings
-from django.conf.urls.static import static
+from .storage import media_urlpatterns
 
 urlpatterns = [
     # --------------------------------------------------
     # STORE FRONT — MUST BE LAST!
     # --------------------------------------------------
     path('', storefront_view, name='storefront'),
+    path('products/more/', storefront_products_fragment_view, name='storefront_products_fragment'),
     path('product/<int:product_id>/', storefront_product_detail_view, name='product_detail'),
+    path('img/<int:image_id>/<int:width>/', product_image_view, name='product_image'),
+    path('resize/<slug:kind>/<int:pk>/<int:width>/<slug:signature>.<slug:extension>', image_resize_view, name='image_resize'),
     path('like-product/<int:product_id>/', like_product_view, name='like_product'),
+    path('liked-products/', liked_products_view, name='liked_products'),
     path('add-comment/<int:product_id>/', add_comment_view, name='add_comment'),
 
+    # Read-only JSON API
+    path('api/v1/products/', api_products_view, name='api_products'),
+    path('api/v1/products/batch/', api_products_batch_view, name='api_products_batch'),
+    path('api/v1/categories/', api_categories_view, name='api_categories'),
+    path('api/v1/announcements/', api_announcements_view, name='api_announcements'),
 
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+
+]+ media_urlpatterns()
\ No newline at end of file
@@ -1,61 +1,61 @@
-from django.utils.deprecation import MiddlewareMixin
-from .models import Store
+import re
 
-class SubdomainMiddleware(MiddlewareMixin):
-    EXCLUDED_HOSTS = []
+from django.conf import settings
+from django.http.request import split_domain_port
 
-    def process_request(self, request):
-        host = request.get_host().split(':')[0]  # remove port
-        parts = host.split('.')
+from .store_cache import get_store_by_custom_domain, get_store_by_subdomain
 
-        # Determine subdomain
-        subdomain = None
-        if len(parts) >= 3:
-            subdomain = parts[0]
-        elif len(parts) == 2 and parts[1] in ["localhost", "devtunnels.ms"]:
-            subdomain = parts[0]
+MAIN_URLCONF = 'core.urls'
+STOREFRONT_URLCONF = 'core.storefront_urls'
 
-        # Skip excluded hosts
-        if not subdomain or subdomain in self.EXCLUDED_HOSTS:
-            request.subdomain_store = None
-            return
 
-        # Try fetching store
-        try:
-            request.subdomain_store = Store.objects.get(subdomain=subdomain)
-        except Store.DoesNotExist:
-            request.subdomain_store = None
-
-
-
-class SubdomainURLRoutingMiddleware:
+class HostResolverMiddleware:
     """
-    Switch URLconf based on requested host/subdomain,
-    but leave admin URL intact.
+    Resolve the request host once:
+    - <sub>.<base domain>  → storefront URLconf, store looked up by subdomain
+    - a store's custom domain → storefront URLconf, store looked up in the domain index
+    - anything else (base domain, IPs, *.devtunnels.ms tunnels) → main site
+
+    Sets request.urlconf and request.subdomain_store. /admin/ always stays on
+    ROOT_URLCONF.
     """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
+        base_domains = getattr(settings, 'STOREFRONT_BASE_DOMAINS', ['bazaa.digital', 'localhost'])
+        self.base_domains = frozenset(d.lower() for d in base_domains)
+        self.reserved = frozenset(getattr(settings, 'RESERVED_SUBDOMAINS', ['www']))
+        self.subdomain_re = re.compile(
+            r'^(?P<subdomain>[^.]+)\.(?:%s)$'
+            % '|'.join(re.escape(d) for d in sorted(self.base_domains, key=len, reverse=True))
+        )
+
     def __call__(self, request):
-        host = request.get_host().split(':')[0]  # strip port
-        path = request.path
-
-        # Leave admin alone
-        if path.startswith('/admin/'):
-            return self.get_response(request)
-
-        urlconf = 'core.urls'  # default
-
-        # Localhost testing: subdomain.localhost
-        parts = host.split('.')
-        if host == 'localhost' or host.startswith('127.0.0.1'):
-            if len(parts) == 2:  # uchumi.localhost
-                urlconf = 'core.storefront_urls'
-        else:
-            # Production
-            if host.endswith('.bazaa.digital') and host != 'bazaa.digital':
-                urlconf = 'core.storefront_urls'
-
-        request.urlconf = urlconf
+        store, is_storefront = self.resolve(request.get_host())
+        request.subdomain_store = store
+
+        # Leave admin on ROOT_URLCONF
+        if not request.path.startswith('/admin/'):
+            request.urlconf = STOREFRONT_URLCONF if is_storefront else MAIN_URLCONF
+
         return self.get_response(request)
 
+    def resolve(self, host):
+        """Return (store or None, is_storefront_host)."""
+        domain, _port = split_domain_port(host)
+        domain = domain.lower()
+
+        if not domain or domain in self.base_domains:
+            return None, False
+
+        match = self.subdomain_re.match(domain)
+        if match:
+            subdomain = match.group('subdomain')
+            if subdomain in self.reserved:
+                return None, False
+            # unknown subdomains still get the storefront's "store not found" page
+            return get_store_by_subdomain(subdomain), True
+
+        store = get_store_by_custom_domain(domain)
+        return store, store is not None
@@ -0,0 +1,63 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from core import image_cache
+from core.renditions import FALLBACK_FORMAT, FORMATS
+
+register = template.Library()
+
+
+def _srcset(image, entries):
+    storage = image.image.storage
+    return ", ".join(f"{storage.url(name)} {width}w" for width, name in entries)
+
+
+def _fallback_url(image):
+    for file in (image.image_medium, image.image):
+        if file:
+            return file.url
+    return ""
+
+
+@register.simple_tag
+def picture(image, sizes="100vw", alt="", **attrs):
+    """
+    <picture> for a ProductImage: one <source> per modern format in its
+    renditions manifest (best first) and a JPEG <img> with srcset. Images
+    not rendered yet get a plain <img> of the original.
+
+        {% picture product.primary_image sizes="50vw" alt=product.title class="w-100" %}
+    """
+    if not image:
+        return ""
+    manifest = image.renditions or {}
+
+    sources = format_html_join("", '<source type="{}" srcset="{}" sizes="{}">', (
+        (fmt.mime, _srcset(image, manifest[fmt.name]), sizes)
+        for fmt in FORMATS if fmt.name != FALLBACK_FORMAT and manifest.get(fmt.name)
+    ))
+
+    attrs.setdefault("loading", "lazy")
+    attrs.setdefault("decoding", "async")
+    if manifest.get(FALLBACK_FORMAT):
+        attrs = {"srcset": _srcset(image, manifest[FALLBACK_FORMAT]), "sizes": sizes, **attrs}
+    # data_image_id=… → data-image-id="…"
+    img_attrs = format_html_join("", ' {}="{}"', ((name.replace("_", "-"), value) for name, value in attrs.items()))
+
+    return format_html(
+        '<picture>{}<img src="{}" alt="{}"{}></picture>', sources, _fallback_url(image), alt, img_attrs
+    )
+
+
+@register.simple_tag(takes_context=True)
+def resized_url(context, obj, width, extension="webp", absolute=False):
+    """
+    Signed on-demand resize URL (core.image_cache) for a ProductImage or
+    Store logo at an allow-listed width, e.g. for Open Graph previews.
+
+        {% resized_url primary_image 1200 "jpg" absolute=True %}
+    """
+    url = image_cache.resized_url(obj, int(width), extension) if obj else ""
+    if url and absolute and context.get("request") is not None:
+        url = context["request"].build_absolute_uri(url)
+    return url
@@ -1,3 +1,1047 @@
-from django.test import TestCase
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    geoip, image_cache, image_jobs, likes, related, renditions, search, store_cache, views, write_buffer,
+)
+from .analytics import purge_visits, run_rollup, store_traffic
+from .checks import check_shared_cache
+from .facets import parse_price
+from .interning import INTERNERS, _digest
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_keyset, paginate_ranked
+from .models import (
+    Category, ImageJob, Like, Product, ProductImage, RelatedProduct, Store, User, Visitor, VisitorDailyRollup,
+    VisitorHourlyRollup, VisitorLocation, VisitorPath, VisitorReferrer, VisitorUserAgent,
+)
+from .storage import is_content_addressed
+from .store_cache import (
+    CustomDomainIndex, _cache_key, _content_version_key, bump_content_version, get_content_version,
+    get_store_by_subdomain,
+)
+from .subdomain_middleware import HostResolverMiddleware
+from .visitor_log import log_visit
+from .write_buffer import BufferedWriter
+
+
+def image_upload(name="photo.jpg", size=(64, 48), color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+class MediaTestCase(TestCase):
+    """Uploads go to a throwaway MEDIA_ROOT; visits and related lists are written on the request thread."""
+    databases = {"default", "analytics", "cache"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, IMAGE_RESIZE_CACHE_DIR=f"{cls.media_root}/image_cache",
+            VISITOR_LOG_MODE="sync",
+            RELATED_REFRESH_MODE="sync",
+        )
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        # per-process caches would otherwise keep ids of rolled back rows (the
+        # shared cache tables roll back with each test)
+        caches["local"].clear()
+        for interner in INTERNERS.values():
+            interner._cache.clear()
+
+
+class StoreTestCase(MediaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="secret", role="shop_manager")
+        cls.store = Store.objects.create(
+            owner=cls.owner, name="Duka", subdomain="duka", logo=image_upload("logo.jpg"),
+            whatsapp_number="254700000000",
+        )
+
+    def make_product(self, title="Kikoi", price=1000, **kwargs):
+        return Product.objects.create(store=self.store, title=title, price=price, **kwargs)
+
+
+# -------------------------
+# Shared cache (core.store_cache)
+# -------------------------
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_configured_cache_is_shared(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "core_cache"},
+        "stores": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "local": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    })
+    def test_warns_about_process_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ["core.W001"])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "t"}})
+    def test_requires_store_and_local_caches(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ["core.E001", "core.E001"])
+
+
+class StorefrontCacheTests(StoreTestCase):
+    def get(self, path="/", **headers):
+        return self.client.get(path, HTTP_HOST="duka.localhost", **headers)
+
+    def test_catalog_change_retires_cached_fragments(self):
+        product = self.make_product(title="Kikoi")
+        self.assertContains(self.get(), "Kikoi")
+        product.title = "Kanga"
+        product.save()
+        response = self.get()
+        self.assertContains(response, "Kanga")
+        self.assertNotContains(response, "Kikoi")
+
+    def test_bump_from_another_worker_reaches_this_one(self):
+        self.make_product()
+        version = get_content_version(self.store.id)
+        # another process writes the same cache table
+        other_worker = caches.create_connection("stores")
+        other_worker.set(_content_version_key(self.store.id), version + 1, None)
+        self.assertEqual(get_content_version(self.store.id), version + 1)
+
+    def test_culling_fragments_keeps_content_versions(self):
+        self.make_product()
+        etag = self.get()["ETag"]
+        cache.clear()  # what culling a full fragment cache may do
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_visitor_dedupe_stays_in_process(self):
+        self.get()
+        keys = [key.split(":", 2)[2] for key in caches["local"]._cache]  # stored as ":<version>:<key>"
+        self.assertTrue(keys)
+        self.assertTrue(all(key.startswith("visitor:") for key in keys))
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_conditional_get(self):
+        self.make_product()
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        bump_content_version(self.store.id)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_store_saved_by_another_worker_is_not_served_as_not_modified(self):
+        etag = self.get()["ETag"]  # also keeps the store in this worker's local LRU
+        # what Store.save() and its signals do in another process
+        Store.objects.filter(pk=self.store.pk).update(name="Duka Jipya")
+        other_worker = caches.create_connection("stores")
+        other_worker.delete(_cache_key("duka"))
+        other_worker.set(_content_version_key(self.store.id), time.time_ns(), None)
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Duka Jipya")
+
+
+class StoreLookupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        store_cache._local.clear()
+
+    def test_misses_are_cached(self):
+        self.assertIsNone(get_store_by_subdomain("hakuna"))
+        self.assertEqual(store_cache.cache.get(_cache_key("hakuna")), store_cache._NOT_FOUND)
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_store_by_subdomain("hakuna"))
+        store_cache._local.clear()  # another worker: only the shared entry
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_store_by_subdomain("hakuna"))
+
+    def test_new_store_replaces_a_cached_miss(self):
+        self.assertIsNone(get_store_by_subdomain("mpya"))
+        owner = User.objects.create_user("other", password="secret", role="shop_manager")
+        store = Store.objects.create(owner=owner, name="Mpya", subdomain="mpya", whatsapp_number="254700000001")
+        self.assertEqual(get_store_by_subdomain("mpya"), store)
+
+    def test_rename_drops_the_old_subdomain(self):
+        self.assertEqual(get_store_by_subdomain("duka"), self.store)
+        self.store.subdomain = "duka-jipya"
+        self.store.save()
+        self.assertIsNone(store_cache.cache.get(_cache_key("duka")))
+        self.assertIsNone(get_store_by_subdomain("duka"))
+        self.assertEqual(get_store_by_subdomain("duka-jipya").subdomain, "duka-jipya")
+
+    def test_rename_reaches_other_workers(self):
+        self.assertEqual(get_store_by_subdomain("duka"), self.store)
+        # another worker renames it: its signals clear the shared entry and bump the
+        # version, but not this worker's local copy
+        Store.objects.filter(pk=self.store.pk).update(subdomain="duka-jipya")
+        store_cache.cache.delete(_cache_key("duka"))
+        bump_content_version(self.store.pk)
+        self.assertIsNone(get_store_by_subdomain("duka"))
+
+
+class HostResolutionTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.middleware = HostResolverMiddleware(lambda request: None)
+
+    def test_subdomain_and_tunnel_hosts(self):
+        self.assertEqual(self.middleware.resolve("duka.localhost:8000"), (self.store, True))
+        self.assertEqual(self.middleware.resolve("bazaa.digital"), (None, False))
+        # dev tunnels serve the main site, as before the host resolver
+        self.assertEqual(self.middleware.resolve("abc-8000.euw.devtunnels.ms"), (None, False))
+
+    def test_domain_index_reloads_after_max_age_without_a_bump(self):
+        index = CustomDomainIndex(check_interval=0, max_age=0)
+        self.assertIsNone(index.lookup("shop.example.com"))
+        # no signals, so no version bump
+        Store.objects.filter(pk=self.store.pk).update(custom_domain="shop.example.com")
+        self.assertEqual(index.lookup("www.shop.example.com"), "duka")
+
+    def test_domain_index_follows_version_bumps(self):
+        index = CustomDomainIndex(check_interval=0, max_age=3600)
+        self.assertIsNone(index.lookup("shop.example.com"))
+        self.store.custom_domain = "Shop.Example.com"
+        self.store.save()
+        self.assertEqual(index.lookup("shop.example.com"), "duka")
+
+
+# -------------------------
+# Image derivative queue (core.image_jobs)
+# -------------------------
+@override_settings(IMAGE_DERIVATIVE_MODE="queued")
+class UnprocessedImageTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+        self.image = ProductImage.objects.create(product=self.product, image=image_upload(), is_primary=True)
+        self.client.force_login(self.owner)
+
+    def test_upload_is_queued_without_derivatives(self):
+        self.assertTrue(ImageJob.objects.filter(image=self.image).exists())
+        self.assertFalse(self.image.image_thumb)
+        self.assertEqual(self.image.thumb_url, self.image.image.url)
+        self.assertEqual(self.image.medium_url, self.image.image.url)
+
+    def test_dashboard_renders_unprocessed_image(self):
+        response = self.client.get("/dashboard/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.image.image.url)
+
+    def test_product_management_renders_unprocessed_image(self):
+        response = self.client.get("/product-management/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.image.image.url)
+
+
+class ImageJobQueueTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = ProductImage.objects.create(product=self.make_product(), image=image_upload())
+        self.job = ImageJob.objects.get(image=self.image)
+
+    def test_claim_takes_each_job_once(self):
+        self.assertEqual(image_jobs.claim(10), [self.job.id])
+        self.assertEqual(image_jobs.claim(10), [])
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), (ImageJob.RUNNING, 1))
+
+    @override_settings(IMAGE_JOB_TIMEOUT=60)
+    def test_stale_running_job_is_reclaimed(self):
+        image_jobs.claim(10)
+        ImageJob.objects.filter(pk=self.job.pk).update(started_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(image_jobs.claim(10), [self.job.id])
+
+    @override_settings(IMAGE_JOB_MAX_ATTEMPTS=2)
+    def test_failed_job_is_retried_then_kept(self):
+        with self.assertLogs("core.image_jobs", "WARNING"):
+            image_jobs.claim(10)
+            image_jobs.finish(self.job.id, "boom")
+            self.assertEqual(ImageJob.objects.get(pk=self.job.pk).status, ImageJob.PENDING)
+            image_jobs.claim(10)
+            image_jobs.finish(self.job.id, "boom")
+        job = ImageJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.error), (ImageJob.FAILED, "boom"))
+        self.assertEqual(image_jobs.claim(10), [])
+
+    def test_render_stores_derivatives(self):
+        image_jobs.claim(10)
+        # render() normally runs in a fresh pool process
+        with mock.patch.object(image_jobs, "close_old_connections"):
+            self.assertIsNone(image_jobs.render(self.job.id))
+        image_jobs.finish(self.job.id)
+        self.image.refresh_from_db()
+        self.assertTrue(self.image.image_thumb)
+        self.assertNotEqual(self.image.thumb_url, self.image.image.url)
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertEqual(image_jobs.enqueue_missing(), 0)
+
+
+# -------------------------
+# Write-behind buffer (core.write_buffer)
+# -------------------------
+class BufferedWriterTests(SimpleTestCase):
+    def make_writer(self, **kwargs):
+        self.batches = []
+        self.written = threading.Event()
+        writer = BufferedWriter(self.record, name="test-writer", **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def record(self, batch):
+        self.batches.append(list(batch))
+        self.written.set()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "the writer thread never caught up")
+            time.sleep(0.01)
+
+    def test_full_batches_are_written_without_waiting_for_the_interval(self):
+        writer = self.make_writer(batch_size=3, flush_interval=60)
+        for item in range(7):
+            writer.put(item)
+        self.wait_for(lambda: len(self.batches) == 2)
+        self.assertEqual(self.batches, [[0, 1, 2], [3, 4, 5]])
+
+        writer.close()  # drains the partial batch
+        self.assertEqual(self.batches[-1], [6])
+
+    def test_partial_batch_is_written_after_the_interval(self):
+        writer = self.make_writer(batch_size=100, flush_interval=0.05)
+        writer.put("visit")
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [["visit"]])
+
+    def test_put_after_close_writes_synchronously(self):
+        writer = self.make_writer()
+        writer.close()
+        self.assertTrue(writer.put("late"))
+        self.assertEqual(self.batches, [["late"]])
+
+    def test_full_queue_drops_items(self):
+        writer = self.make_writer(max_queue_size=2)
+        with mock.patch.object(writer, "_ensure_started"):  # nothing drains the queue
+            self.assertTrue(writer.put(1))
+            self.assertTrue(writer.put(2))
+            with self.assertLogs("core.write_buffer", "WARNING"):
+                self.assertFalse(writer.put(3))
+        writer.flush()
+        self.assertEqual(self.batches, [[1, 2]])
+
+    def test_failed_batch_is_logged_and_the_thread_carries_on(self):
+        writer = self.make_writer(batch_size=1, flush_interval=0.01)
+        failures = [DatabaseError("database is locked")]
+
+        def flaky(batch):
+            if failures:
+                raise failures.pop()
+            self.record(batch)
+
+        writer.flush_func = flaky
+        with self.assertLogs("core.write_buffer", "ERROR") as logs:
+            writer.put("lost")
+            self.wait_for(lambda: logs.records)
+        writer.put("kept")
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [["kept"]])
+
+    @override_settings(TEST_WRITER_BATCH_SIZE=7)
+    def test_singleton_is_shared_and_configured_from_settings(self):
+        self.addCleanup(write_buffer._writers.pop, "test-singleton", None)
+        writer = BufferedWriter.singleton("test-singleton", self.record, "TEST_WRITER", flush_interval=0.5)
+        self.addCleanup(writer.close)
+        self.assertIs(BufferedWriter.singleton("test-singleton", self.record, "TEST_WRITER"), writer)
+        self.assertEqual((writer.batch_size, writer.flush_interval, writer.name), (7, 0.5, "test-singleton"))
+
+
+# -------------------------
+# Visitor rollups and retention (core.analytics)
+# -------------------------
+class VisitorRollupTests(MediaTestCase):
+    ALL = VisitorDailyRollup.ALL
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def visit(self, session="a", path="/", when=None, country="Kenya", referrer=""):
+        log_visit(store_id=7, session_key=session, url_path=path, country=country, referrer=referrer,
+                  visit_date=when or self.now)
+
+    def totals(self, model, **filters):
+        return model.objects.filter(store_id=7, path=self.ALL, country=self.ALL, **filters)
+
+    def test_distinct_visitors_stay_exact_across_runs(self):
+        self.visit("a")
+        run_rollup()
+        self.visit("a", referrer="https://wa.me/")
+        self.visit("b", path="/product/1/")
+        self.assertEqual(run_rollup()["visits"], 2)
+
+        for model in (VisitorHourlyRollup, VisitorDailyRollup):
+            row = self.totals(model).get()
+            self.assertEqual((row.views, row.unique_visitors), (3, 2))
+            self.assertEqual(row.top_referrers, [["https://wa.me/", 1]])
+        home = VisitorDailyRollup.objects.get(store_id=7, path="/", country="Kenya")
+        self.assertEqual((home.views, home.unique_visitors), (2, 1))
+        self.assertEqual(run_rollup()["visits"], 0)
+
+    @override_settings(VISITOR_RETENTION_DAYS=2)
+    def test_purged_buckets_are_left_alone(self):
+        old = self.now - timedelta(days=10)
+        day = timezone.localtime(old).date()
+        VisitorDailyRollup.objects.create(store_id=7, bucket=day, path=self.ALL, country=self.ALL, views=40)
+        # a late write for a day whose raw rows are long purged
+        self.visit("a", when=old)
+        self.visit("b")
+        run_rollup()
+
+        self.assertEqual(self.totals(VisitorDailyRollup, bucket=day).get().views, 40)
+        today = self.totals(VisitorDailyRollup, bucket=timezone.localdate()).get()
+        self.assertEqual(today.views, 1)
+
+    def test_purge_deletes_only_rolled_up_expired_visits_in_batches(self):
+        for i in range(5):
+            self.visit(f"old-{i}", when=self.now - timedelta(days=3))
+        self.visit("recent")
+        self.assertEqual(purge_visits(retention_days=1), 0)  # nothing rolled up yet
+
+        run_rollup()
+        self.visit("late", when=self.now - timedelta(days=3))  # not rolled up: kept
+        with CaptureQueriesContext(connections["analytics"]) as queries:
+            self.assertEqual(purge_visits(retention_days=1, batch_size=2), 5)
+        deletes = [q for q in queries.captured_queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(sorted(Visitor.objects.values_list("session_key", flat=True)), ["late", "recent"])
+
+    def test_store_traffic_reads_the_daily_rollups(self):
+        today = timezone.localdate()
+        for offset, views in ((0, 10), (2, 5)):
+            day = today - timedelta(days=offset)
+            VisitorDailyRollup.objects.create(store_id=7, bucket=day, path=self.ALL, country=self.ALL,
+                                              views=views, unique_visitors=views - 1)
+            VisitorDailyRollup.objects.create(store_id=7, bucket=day, path="/", country="Kenya", views=views)
+        VisitorDailyRollup.objects.create(store_id=8, bucket=today, path=self.ALL, country=self.ALL, views=99)
+
+        traffic = store_traffic(7, days=3)
+        self.assertEqual([(day["date"], day["views"], day["percent"]) for day in traffic["days"]], [
+            (today - timedelta(days=2), 5, 50),
+            (today - timedelta(days=1), 0, 0),
+            (today, 10, 100),
+        ])
+        self.assertEqual(traffic["days"][2]["unique_visitors"], 9)
+        self.assertEqual(traffic["total_views"], 15)
+        self.assertEqual(traffic["top_pages"], [{"path": "/", "views": 15}])
+        self.assertEqual(traffic["top_countries"], [{"country": "Kenya", "views": 15}])
+
+
+# -------------------------
+# Analytics database move (move_analytics_data)
+# -------------------------
+class MoveAnalyticsDataTests(MediaTestCase):
+    """Visits left in "default" from before the analytics database existed."""
+    legacy_models = [VisitorUserAgent, VisitorPath, VisitorReferrer, VisitorLocation, Visitor]
+
+    @classmethod
+    def setUpClass(cls):
+        with connections["default"].schema_editor() as editor:
+            for model in cls.legacy_models:
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connections["default"].schema_editor() as editor:
+            for model in reversed(cls.legacy_models):
+                editor.delete_model(model)
+
+    def legacy_visit(self, path, visit_date):
+        path_ref, _ = VisitorPath.objects.using("default").get_or_create(digest=_digest(path), value=path)
+        return Visitor.objects.using("default").create(store_id=7, path_ref=path_ref, visit_date=visit_date)
+
+    def test_keeps_visits_whose_ids_collide_and_rolls_them_up(self):
+        now = timezone.now()
+        # written since the analytics database went live: ids start at 1 there too
+        log_visit(store_id=7, url_path="/new", visit_date=now)
+        run_rollup()
+        legacy = [self.legacy_visit("/old", now - timedelta(days=1)), self.legacy_visit("/new", now)]
+        self.assertEqual(legacy[0].pk, Visitor.objects.get().pk)
+
+        call_command("move_analytics_data", "--delete-source", "--chunk-size=1", stdout=StringIO())
+
+        paths = sorted(visit.path_value for visit in Visitor.objects.select_related("path_ref"))
+        self.assertEqual(paths, ["/new", "/new", "/old"])
+        self.assertFalse(Visitor.objects.using("default").exists())
+        self.assertFalse(VisitorPath.objects.using("default").exists())
+        totals = VisitorDailyRollup.objects.filter(store_id=7, path=VisitorDailyRollup.ALL, country=VisitorDailyRollup.ALL)
+        self.assertEqual(sum(row.views for row in totals), 3)
+
+    def test_keeps_source_rows_without_delete_source(self):
+        self.legacy_visit("/old", timezone.now())
+        call_command("move_analytics_data", stdout=StringIO())
+        self.assertEqual(Visitor.objects.count(), 1)
+        self.assertEqual(Visitor.objects.using("default").count(), 1)
+
+
+# -------------------------
+# Product.save() and signal-maintained columns
+# -------------------------
+class ProductSaveTests(StoreTestCase):
+    def test_stale_instance_keeps_counters_and_primary_image(self):
+        product = self.make_product()
+        stale = Product.objects.get(pk=product.pk)
+        image = ProductImage.objects.create(product=product, image=image_upload())
+        Like.objects.create(product=product, user_ip="10.0.0.1")
+
+        stale.title = "Kanga"
+        stale.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.title, "Kanga")
+        self.assertEqual(product.primary_image_id, image.pk)
+        self.assertEqual(product.like_count, 1)
+
+    def test_saving_a_deleted_product_inserts_it_again(self):
+        product = self.make_product()
+        stale = Product.objects.get(pk=product.pk)
+        product.delete()
+
+        stale.save()
+        self.assertTrue(Product.objects.filter(pk=stale.pk, title="Kikoi").exists())
+
+
+class PrimaryImageTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+
+    def primary_id(self):
+        return Product.objects.values_list("primary_image_id", flat=True).get(pk=self.product.pk)
+
+    def test_first_image_becomes_primary_without_a_flag(self):
+        self.assertIsNone(self.primary_id())
+        image = ProductImage.objects.create(product=self.product, image=image_upload())
+        self.assertEqual(self.primary_id(), image.pk)
+
+    def test_flagging_another_image_moves_the_flag(self):
+        first = ProductImage.objects.create(product=self.product, image=image_upload(), is_primary=True)
+        second = ProductImage.objects.create(product=self.product, image=image_upload(color="blue"), is_primary=True)
+        self.assertEqual(self.primary_id(), second.pk)
+        first.refresh_from_db()
+        self.assertFalse(first.is_primary)
+
+        first.is_primary = True
+        first.save()
+        self.assertEqual(self.primary_id(), first.pk)
+        self.assertEqual(list(ProductImage.objects.filter(is_primary=True)), [first])
+
+    def test_deleting_the_primary_falls_back(self):
+        first = ProductImage.objects.create(product=self.product, image=image_upload())
+        second = ProductImage.objects.create(product=self.product, image=image_upload(color="blue"), is_primary=True)
+        second.delete()
+        self.assertEqual(self.primary_id(), first.pk)
+        first.delete()
+        self.assertIsNone(self.primary_id())
+
+
+# -------------------------
+# Likes (core.likes)
+# -------------------------
+class LikeToggleTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+
+    def test_toggle_is_one_short_transaction(self):
+        # savepoint, INSERT ... ON CONFLICT, UPDATE ... RETURNING, release
+        with self.assertNumQueries(4):
+            self.assertEqual(likes.toggle_like(self.product, "10.0.0.1"), (True, 1))
+        # savepoint, INSERT (no-op), DELETE, UPDATE ... RETURNING, release
+        with self.assertNumQueries(5):
+            self.assertEqual(likes.toggle_like(self.product, "10.0.0.1"), (False, 0))
+        self.assertFalse(Like.objects.exists())
+
+    def test_like_endpoint(self):
+        url = f"/like-product/{self.product.pk}/"
+        response = self.client.post(url, HTTP_HOST="duka.localhost", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.json(), {"liked": True, "like_count": 1})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).like_count, 1)
+
+    def test_drifted_counter_does_not_go_negative(self):
+        Like.objects.create(product=self.product, user_ip="10.0.0.1")
+        Product.objects.filter(pk=self.product.pk).update(like_count=0)
+        self.assertEqual(likes.toggle_like(self.product, "10.0.0.1"), (False, 0))
+
+    def test_reconcile_counters_repairs_drift(self):
+        likes.toggle_like(self.product, "10.0.0.1")
+        Product.objects.filter(pk=self.product.pk).update(like_count=7)
+        call_command("reconcile_counters", stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).like_count, 1)
+
+
+@override_settings(LIKE_WRITE_MODE="buffered")
+class BufferedLikeTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+        likes._pending.clear()
+        # hold the toggles instead of handing them to the background thread
+        self.queued = []
+        writer = mock.Mock(put=lambda item: self.queued.append(item) or True)
+        patcher = mock.patch.object(likes, "get_writer", return_value=writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_toggles_are_counted_optimistically_then_written(self):
+        self.assertEqual(likes.toggle_like(self.product, "10.0.0.1"), (True, 1))
+        self.assertEqual(likes.toggle_like(self.product, "10.0.0.2"), (True, 2))
+        likes._apply_toggles(self.queued)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.like_count, 2)
+        self.assertNotIn(self.product.pk, likes._pending)
+
+    def test_counter_matches_rows_when_another_process_inserts_first(self):
+        likes.toggle_like(self.product, "10.0.0.1")
+        likes.toggle_like(self.product, "10.0.0.2")
+        bulk_create = Like.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            Like.objects.create(product=self.product, user_ip="10.0.0.1")  # another worker's toggle
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Like.objects, "bulk_create", side_effect=racing_bulk_create):
+            likes._apply_toggles(self.queued)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.like_count, 2)
+
+    def test_unlikes_are_written_in_one_batch(self):
+        for ip in ("10.0.0.1", "10.0.0.2"):
+            Like.objects.create(product=self.product, user_ip=ip)
+        self.product.refresh_from_db()
+        self.assertEqual(likes.toggle_like(self.product, "10.0.0.1"), (False, 1))
+        likes._apply_toggles(self.queued)
+        self.assertEqual(list(Like.objects.values_list("user_ip", flat=True)), ["10.0.0.2"])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).like_count, 1)
+
+    def test_failed_flush_does_not_leave_counts_off(self):
+        likes.toggle_like(self.product, "10.0.0.1")
+        with mock.patch.object(Like.objects, "bulk_create", side_effect=DatabaseError("disk I/O error")):
+            with self.assertRaises(DatabaseError):
+                likes._apply_toggles(self.queued)
+        self.assertNotIn(self.product.pk, likes._pending)
+
+        # the lost like isn't counted any more: the next toggle starts from the DB
+        self.product.refresh_from_db()
+        self.assertEqual(likes.toggle_like(self.product, "10.0.0.2"), (True, 1))
+
+
+# -------------------------
+# Content-addressed media (core.storage)
+# -------------------------
+class ContentAddressedStorageTests(StoreTestCase):
+    def age(self, name, hours):
+        path = default_storage.path(name)
+        past = time.time() - hours * 3600
+        os.utime(path, (past, past))
+
+    def collect_garbage(self):
+        call_command("collect_media_garbage", "--grace-hours=24", stdout=StringIO())
+
+    def test_identical_uploads_share_one_file(self):
+        product = self.make_product()
+        first = ProductImage.objects.create(product=product, image=image_upload("a.jpg"))
+        second = ProductImage.objects.create(product=product, image=image_upload("b.jpg"))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_addressed(first.image.name))
+
+    def test_collects_only_old_unreferenced_files(self):
+        product = self.make_product()
+        image = ProductImage.objects.create(product=product, image=image_upload())
+        name = image.image.name
+        self.age(name, 48)
+        self.collect_garbage()
+        self.assertTrue(default_storage.exists(name))  # referenced
+
+        image.delete()
+        self.collect_garbage()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_reupload_of_an_unreferenced_file_survives_collection(self):
+        product = self.make_product()
+        image = ProductImage.objects.create(product=product, image=image_upload())
+        name = image.image.name
+        image.delete()
+        self.age(name, 48)
+
+        # the same photo again: stored under the same name, its row not committed yet
+        self.assertEqual(default_storage.save("store_products/again.jpg", image_upload()), name)
+        self.collect_garbage()
+        self.assertTrue(default_storage.exists(name))
+
+
+# -------------------------
+# Offline GeoIP (core.geoip)
+# -------------------------
+class GeoIPTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, "ranges.dat")
+        override = override_settings(GEOIP_DATABASE=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.reset_process_database()
+        self.addCleanup(self.reset_process_database)
+
+    def reset_process_database(self):
+        geoip._database = geoip._database_mtime = geoip._checked_at = None
+
+    def write_csv(self, *rows):
+        path = os.path.join(self.directory, "ranges.csv")
+        with open(path, "w", newline="") as fh:
+            csv.writer(fh).writerows(rows)
+        return path
+
+    def test_lookup(self):
+        database = geoip.GeoIPDatabase.from_ranges([
+            ("41.90.0.0", "41.90.255.255", "Nairobi, Kenya"),
+            ("2c0f:fe38::", "2c0f:fe38:ffff:ffff:ffff:ffff:ffff:ffff", "Kenya"),
+        ])
+        database.save(self.path)
+        database = geoip.GeoIPDatabase.load(self.path)
+        self.assertEqual(database.lookup("41.90.1.2"), "Nairobi, Kenya")
+        self.assertEqual(database.lookup("::ffff:41.90.1.2"), "Nairobi, Kenya")
+        self.assertEqual(database.lookup("2c0f:fe38::1"), "Kenya")
+        self.assertIsNone(database.lookup("41.91.0.0"))
+
+    def test_rejects_overlapping_ranges(self):
+        with self.assertRaisesMessage(ValueError, "Overlapping ranges"):
+            geoip.GeoIPDatabase.from_ranges([
+                ("10.0.0.0", "10.0.255.255", "A"),
+                ("10.0.128.0", "10.1.0.0", "B"),
+            ])
+
+    def test_bad_file_keeps_the_previous_database(self):
+        geoip.GeoIPDatabase.from_ranges([("10.0.0.0", "10.0.0.255", "A")]).save(self.path)
+        self.assertEqual(geoip.lookup("10.0.0.1"), "A")
+
+        with open(self.path, "r+b") as fh:
+            fh.truncate(os.path.getsize(self.path) - 3)
+        os.utime(self.path, (time.time() + 5, time.time() + 5))
+        geoip._checked_at = None
+        with self.assertLogs("core.geoip", "ERROR"):
+            self.assertEqual(geoip.lookup("10.0.0.1"), "A")
+
+    def test_foreign_file_means_no_database(self):
+        with open(self.path, "wb") as fh:
+            fh.write(b"GIF89a")
+        with self.assertLogs("core.geoip", "ERROR"):
+            self.assertIsNone(geoip.lookup("10.0.0.1"))
+
+    def test_import_skips_oversized_labels(self):
+        csv_path = self.write_csv(
+            ["start_ip", "end_ip", "country"],
+            ["10.0.0.0", "10.0.0.255", "Kenya"],
+            ["10.0.1.0", "10.0.1.255", "x" * 70000],
+        )
+        out = StringIO()
+        call_command("import_geoip", csv_path, stdout=out)
+        self.assertIn("Skipped 1 rows", out.getvalue())
+        self.assertEqual(geoip.GeoIPDatabase.load(self.path).lookup("10.0.0.1"), "Kenya")
+
+    def test_import_rejects_overlapping_ranges(self):
+        csv_path = self.write_csv(["10.0.0.0", "10.0.0.255", "A"], ["10.0.0.255", "10.0.1.255", "B"])
+        with self.assertRaisesMessage(CommandError, "Overlapping ranges"):
+            call_command("import_geoip", csv_path, stdout=StringIO())
+
+
+# -------------------------
+# Related products (core.related)
+# -------------------------
+class RelatedProductTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(store=self.store, name="Vitenge")
+        self.products = [self.make_product(title=f"Kitenge {i}") for i in range(3)]
+        for product in self.products:
+            product.categories.add(self.category)
+
+    def related_ids(self, product):
+        return list(RelatedProduct.objects.filter(product=product).order_by("rank").values_list("related_id", flat=True))
+
+    @override_settings(RELATED_REFRESH_MODE="sync")
+    def test_refreshed_after_commit(self):
+        new = self.make_product(title="Kitenge 3")
+        with self.captureOnCommitCallbacks(execute=True):
+            new.categories.add(self.category)
+        self.assertEqual(self.related_ids(new), [p.pk for p in reversed(self.products)])
+        self.assertIn(new.pk, self.related_ids(self.products[0]))
+
+    @override_settings(RELATED_REFRESH_MODE="buffered")
+    def test_buffered_refresh_leaves_the_request_thread(self):
+        queued = []
+        with mock.patch.object(related, "get_writer", return_value=mock.Mock(put=queued.append)):
+            new = self.make_product(title="Kitenge 3")
+            with self.captureOnCommitCallbacks(execute=True):
+                new.categories.add(self.category)
+        self.assertEqual(self.related_ids(new), [])  # nothing computed yet
+        self.assertEqual(set(queued), {new.pk, *(p.pk for p in self.products)})
+
+        related.refresh_related(queued)
+        self.assertEqual(len(self.related_ids(new)), 3)
+
+    @override_settings(RELATED_REFRESH_MODE="buffered")
+    def test_deferred_refresh_retires_cached_detail_page(self):
+        url = f"/product/{self.products[0].pk}/"
+        new = self.make_product(title="Kanga Mpya")
+        with mock.patch.object(related, "get_writer", return_value=mock.Mock()):
+            with self.captureOnCommitCallbacks(execute=True):
+                new.categories.add(self.category)
+        # rendered after the signals bumped the version, before the refresh ran
+        response = self.client.get(url, HTTP_HOST="duka.localhost")
+        self.assertNotContains(response, "Kanga Mpya")
+
+        related.refresh_related([self.products[0].pk])
+        response = self.client.get(url, HTTP_HOST="duka.localhost", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Kanga Mpya")
+
+    def test_unchanged_lists_keep_the_version(self):
+        related.refresh_related([p.pk for p in self.products])
+        version = get_content_version(self.store.id)
+        related.refresh_related([p.pk for p in self.products])
+        self.assertEqual(get_content_version(self.store.id), version)
+
+    def test_rebuild_command_bumps_changed_stores(self):
+        RelatedProduct.objects.all().delete()
+        version = get_content_version(self.store.id)
+        call_command("rebuild_related_products", store="duka", stdout=StringIO())
+        self.assertEqual(len(self.related_ids(self.products[0])), 2)
+        self.assertNotEqual(get_content_version(self.store.id), version)
+
+
+# -------------------------
+# Storefront search (core.search)
+# -------------------------
+class SearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(store=self.store, name="Kikoi")
+        # more strong matches than search.MAX_RESULTS, none of them in the category
+        Product.objects.bulk_create([
+            Product(store=self.store, title=f"Kikoi kikoi {i}", price=100) for i in range(search.MAX_RESULTS + 10)
+        ])
+        self.weak = [
+            self.make_product(title=f"Beach wrap {i}", caption="a kikoi " + "cotton " * 50, price=3000)
+            for i in range(3)
+        ]
+        for product in self.weak:
+            product.categories.add(self.category)
+        search.rebuild_index()
+
+    def test_filters_apply_before_the_result_cap(self):
+        for sort in ("relevance", "newest"):
+            page, _sort = views._storefront_page(self.store, "kikoi", str(self.category.pk), sort, "")
+            self.assertCountEqual([p.pk for p in page], [p.pk for p in self.weak])
+        page, _sort = views._storefront_page(self.store, "kikoi", "all", "relevance", "2500-5000")
+        self.assertCountEqual([p.pk for p in page], [p.pk for p in self.weak])
+
+    def test_facets_count_every_match(self):
+        facets = views._storefront_facets(self.store, "kikoi", "all", "")
+        self.assertEqual(facets["categories"][0]["count"], 3)
+        self.assertEqual(sum(bucket["count"] for bucket in facets["prices"]), search.MAX_RESULTS + 13)
+
+    def test_misspelt_query_is_corrected(self):
+        page, _sort = views._storefront_page(self.store, "kikio", str(self.category.pk), "relevance", "")
+        self.assertEqual(len(page), 3)
+
+    def test_api_search_with_category(self):
+        response = self.client.get(
+            "/api/v1/products/", {"q": "kikoi", "category": self.category.pk, "fields": "id"},
+            HTTP_HOST="duka.localhost",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual([row["id"] for row in response.json()["results"]], [p.pk for p in self.weak])
+
+
+# -------------------------
+# Storefront listing parameters and the JSON API
+# -------------------------
+class ListingParamsTests(StoreTestCase):
+    def get(self, path, **params):
+        return self.client.get(path, params, HTTP_HOST="duka.localhost")
+
+    def test_api_rejects_non_numeric_category(self):
+        self.make_product()
+        for category in ("abc", "²", "1.5"):
+            response = self.get("/api/v1/products/", category=category)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"error": "Invalid category."})
+        self.assertEqual(self.get("/api/v1/products/", category="all").status_code, 200)
+
+    def test_storefront_falls_back_to_all_categories(self):
+        self.make_product(title="Kikoi")
+        self.assertContains(self.get("/", category="abc"), "Kikoi")
+        self.assertContains(self.get("/products/more/", category="²"), "Kikoi")
+
+    def test_api_ignores_unusable_numbers(self):
+        product = self.make_product()
+        response = self.get("/api/v1/products/batch/", ids=f"{product.pk},²", fields="id")
+        self.assertEqual(response.json()["results"], [{"id": product.pk}])
+        self.assertEqual(self.get("/api/v1/products/", limit="²").status_code, 200)
+
+    def test_liked_products_ignores_unusable_ids(self):
+        product = self.make_product()
+        Like.objects.create(product=product, user_ip="127.0.0.1")
+        response = self.get("/liked-products/", ids=f"{product.pk},²")
+        self.assertEqual(response.json(), {"liked": [product.pk]})
+
+
+class PriceFacetTests(StoreTestCase):
+    def test_malformed_price_tokens_are_ignored(self):
+        self.assertEqual(parse_price("500-1000"), (500, 1000))
+        self.assertEqual(parse_price("500-"), (500, None))
+        for token in ("²-", "5-²", "abc", "1000-500", "", None):
+            self.assertIsNone(parse_price(token))
+        self.make_product(title="Kikoi")
+        self.assertContains(self.client.get("/", {"price": "²-"}, HTTP_HOST="duka.localhost"), "Kikoi")
+
+
+# -------------------------
+# Image format negotiation (core.renditions)
+# -------------------------
+class AcceptedFormatsTests(SimpleTestCase):
+    def test_quality_values(self):
+        self.assertEqual(renditions.accepted_formats("image/avif,image/webp,*/*"), {"avif", "webp", "jpeg"})
+        self.assertEqual(renditions.accepted_formats("image/webp;q=0.0, image/avif; q=0.5"), {"avif", "jpeg"})
+        self.assertEqual(renditions.accepted_formats("image/webp;q=0, image/avif;q=0.000"), {"jpeg"})
+        self.assertEqual(renditions.accepted_formats("image/webp;q=abc"), {"jpeg"})
+        self.assertEqual(renditions.accepted_formats(""), {"jpeg"})
+
+    def test_pick_prefers_accepted_formats(self):
+        manifest = {
+            "avif": [[300, "a300.avif"], [600, "a600.avif"]],
+            "webp": [[300, "w300.webp"], [600, "w600.webp"]],
+            "jpeg": [[300, "j300.jpg"], [600, "j600.jpg"]],
+        }
+        fmt, name = renditions.pick(manifest, "image/avif;q=0.0,image/webp", 400)
+        self.assertEqual((fmt.name, name), ("webp", "w600.webp"))
+        fmt, name = renditions.pick(manifest, "", 1000)
+        self.assertEqual((fmt.name, name), ("jpeg", "j600.jpg"))
+
+
+# -------------------------
+# Keyset pagination (core.pagination)
+# -------------------------
+class KeysetPaginationTests(StoreTestCase):
+    def pages(self, paginate, *args):
+        ids, cursor = [], None
+        while True:
+            page = paginate(*args, cursor=cursor, per_page=2)
+            ids += [product.id for product in page]
+            if not page.has_next:
+                return ids
+            cursor = page.next_cursor
+
+    def test_walks_every_row_once_across_ties(self):
+        products = [self.make_product(title=f"P{i}", price=price) for i, price in enumerate([300, 100, 200, 100, 300])]
+        queryset = Product.objects.filter(store=self.store)
+        expected = [p.id for p in sorted(products, key=lambda p: (p.price, p.id))]
+        self.assertEqual(self.pages(paginate_keyset, queryset, "price_low"), expected)
+        expected = [p.id for p in sorted(products, key=lambda p: (p.price, p.id), reverse=True)]
+        self.assertEqual(self.pages(paginate_keyset, queryset, "price_high"), expected)
+
+    def test_ranked_pages_skip_filtered_ids(self):
+        products = [self.make_product(title=f"P{i}") for i in range(5)]
+        ranked = [p.id for p in reversed(products)]
+        queryset = Product.objects.exclude(pk=products[2].pk)
+        self.assertEqual(self.pages(paginate_ranked, queryset, ranked), [pk for pk in ranked if pk != products[2].pk])
+
+    def test_rejects_tampered_and_foreign_cursors(self):
+        cursor = encode_cursor("price_low", ["100.00", 1])
+        self.assertEqual(decode_cursor(cursor, "price_low"), ["100.00", 1])
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor, "newest")
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor[:-2] + "xx", "price_low")
+        with self.assertRaises(InvalidCursor):
+            paginate_keyset(Product.objects.all(), "price_low", encode_cursor("price_low", ["cheap", 1]))
+
+    def test_fragment_rejects_bad_cursor(self):
+        self.make_product()
+        response = self.client.get("/products/more/?cursor=bogus", HTTP_HOST="duka.localhost")
+        self.assertEqual(response.status_code, 400)
+
+
+# -------------------------
+# On-demand resizing (core.image_cache)
+# -------------------------
+class ImageResizeTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        image_cache._cache = None  # built from the overridden IMAGE_RESIZE_CACHE_DIR
+        self.addCleanup(setattr, image_cache, "_cache", None)
+        self.image = ProductImage.objects.create(
+            product=self.make_product(), image=image_upload(size=(800, 600)),
+        )
+
+    def test_signed_url_serves_resized_image(self):
+        url = image_cache.resized_url(self.image, 320, "jpg")
+        response = self.client.get(url, HTTP_HOST="duka.localhost")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        with Image.open(BytesIO(b"".join(response.streaming_content))) as img:
+            self.assertEqual(img.size, (320, 240))
+
+    def test_bad_or_outdated_signature_is_404(self):
+        url = image_cache.resized_url(self.image, 320, "jpg")
+        self.assertEqual(self.client.get(url.replace("/320/", "/480/"), HTTP_HOST="duka.localhost").status_code, 404)
+        self.image.image = image_upload("other.jpg", color="blue")
+        self.image.save()
+        self.assertEqual(self.client.get(url, HTTP_HOST="duka.localhost").status_code, 404)
+
+    def test_missing_or_unreadable_source_is_404(self):
+        url = image_cache.resized_url(self.image, 320, "jpg")
+        os.remove(self.image.image.path)
+        self.assertEqual(self.client.get(url, HTTP_HOST="duka.localhost").status_code, 404)
+
+        self.store.logo = SimpleUploadedFile("logo.jpg", b"not an image")
+        self.store.save()
+        url = image_cache.resized_url(self.store, 320, "jpg")
+        self.assertEqual(self.client.get(url, HTTP_HOST="duka.localhost").status_code, 404)
+
+    def test_disk_lru_evicts_least_recently_used(self):
+        lru = image_cache.DiskLRU(os.path.join(self.media_root, "lru"), max_bytes=250)
+        for key in ("a", "b"):
+            lru.open(key, "bin", lambda: b"x" * 100).close()
+        old = time.time() - 60
+        os.utime(lru.path("a", "bin"), (old, old))
+        os.utime(lru.path("b", "bin"), (old - 60, old - 60))
+        lru.open("a", "bin", mock.Mock()).close()  # a hit: "b" is now the oldest
+        lru.open("c", "bin", lambda: b"x" * 100).close()
+        self.assertTrue(lru.path("a", "bin").exists())
+        self.assertFalse(lru.path("b", "bin").exists())
+        self.assertTrue(lru.path("c", "bin").exists())
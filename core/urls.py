@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import *
 from django.conf import settings
-from django.conf.urls.static import static
+from .storage import media_urlpatterns
 
 
 urlpatterns = [
@@ -13,6 +13,7 @@ urlpatterns = [
     path('dashboard/', shop_manager_dashboard_view, name='dashboard'),
     path('product-management/', product_management_view, name='product_management'),
     path('create-store-profile/', create_store_profile, name='create_store_profile'),
+    path('resize/<slug:kind>/<int:pk>/<int:width>/<slug:signature>.<slug:extension>', image_resize_view, name='image_resize'),
 
     # HTMX endpoints
     path('dashboard/htmx/create-announcement/', create_announcement_htmx, name='create_announcement_htmx'),
@@ -24,4 +25,4 @@ urlpatterns = [
     path("reset-password/<str:token>/", reset_password_view, name="reset_password"),
 
 
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]+ media_urlpatterns()
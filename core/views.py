@@ -1,4 +1,4 @@
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
@@ -15,11 +15,27 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from .utils import *
-from django.views.decorators.http import require_POST
+from .analytics import store_traffic
+from .search import filter_matching, match_expression, ranked_ids
+from .facets import get_facets, parse_price, price_q
+from .likes import toggle_like
+from . import api, image_cache
+from .store_cache import get_content_version
+from .renditions import pick
+from .pagination import SORTS as KEYSET_SORTS, InvalidCursor, paginate_keyset, paginate_ranked
+from django.db.models import Count, Q
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.utils import timezone
 import secrets
+import hashlib
+import mimetypes
+from datetime import datetime, timezone as dt_timezone
 from django.urls import reverse
 from django.utils.http import urlencode
+from django.utils.functional import SimpleLazyObject
 
 
 User = get_user_model()
@@ -42,70 +58,236 @@ def get_client_ip(request):
     return request.META.get('REMOTE_ADDR')
 
 
-def storefront_view(request):
-    store = getattr(request, "subdomain_store", None)
-    if store is None:
-        return render(request, "files/store_not_found.html", status=404)
+STOREFRONT_PAGE_SIZE = 12
 
-    client_ip = get_client_ip(request)
-    liked_product_ids = set(
-        Like.objects.filter(user_ip=client_ip, product__store=store)
-                    .values_list('product_id', flat=True)
-    )
 
-    # Base queryset of active products
-    products = store.products.filter(is_active=True).prefetch_related('images')
-    categories = store.categories.all()
-    
-    # === CHANGE THIS LINE - Get ALL active announcements ===
-    active_announcements = list(store.announcements.filter(is_active=True).order_by('-created_at'))
+def _is_id(value):
+    """A plain decimal id; str.isdigit() alone also passes "²", which int() rejects."""
+    return value.isascii() and value.isdigit()
 
-    # =======================================================
 
-    # Search
+def _listing_params(request):
+    """(query, category, sort, price) requested for the storefront listing; an unusable category means all."""
     query = request.GET.get('q', '').strip()
+    category_id = request.GET.get('category', 'all')
+    if not _is_id(category_id):
+        category_id = 'all'
+    sort = request.GET.get('sort') or ('relevance' if query else 'newest')
+    price = request.GET.get('price', '')
+    if parse_price(price) is None:
+        price = ''
+    return query, category_id, sort, price
+
+
+def _search_match(store, query):
+    """FTS match expression for `query` (core.search); None without a query or without FTS."""
+    return match_expression(store, query) if query else None
+
+
+def _storefront_products(store, query, match, category_id='all', price=''):
+    """Filtered product queryset for the storefront listing."""
+    products = store.products.filter(is_active=True).select_related('primary_image')
+
+    # Search (full-text, in SQL alongside the other filters)
     if query:
-        products = products.filter(title__icontains=query)
+        if match is None:  # no FTS on this database
+            products = products.filter(Q(title__icontains=query) | Q(caption__icontains=query))
+        else:
+            products = filter_matching(products, match)
 
     # Category filter
-    category_id = request.GET.get('category', 'all')
     if category_id != 'all':
         products = products.filter(categories__id=category_id)
 
-    # Sorting
-    sort = request.GET.get('sort', 'newest')
-    if sort == 'price_low':
-        products = products.order_by('price')
-    elif sort == 'price_high':
-        products = products.order_by('-price')
-    else:  # newest
-        products = products.order_by('-created_at')
-
-    # Calculate discount
-    for product in products:
-        product.calculate_discount()
-
-    # Pagination
-    paginator = Paginator(products, 12)
-    page = request.GET.get('page', 1)
-    try:
-        paginated_products = paginator.page(page)
-    except PageNotAnInteger:
-        paginated_products = paginator.page(1)
-    except EmptyPage:
-        paginated_products = paginator.page(paginator.num_pages)
+    # Price range filter (a facet bucket, e.g. "500-1000")
+    if price:
+        products = products.filter(price_q(*parse_price(price)))
+
+    return products
+
 
-    return render(request, "files/home.html", {
+def _storefront_page(store, query, category_id, sort, price, cursor=None,
+                     per_page=STOREFRONT_PAGE_SIZE, project=None):
+    """
+    One keyset page of the storefront listing (see core.pagination) and the
+    sort actually used. `project` may narrow the queryset (e.g. .only()).
+    Raises InvalidCursor for tampered or stale cursors.
+    """
+    match = _search_match(store, query)
+    products = _storefront_products(store, query, match, category_id, price)
+
+    # best match first, ranked among the products left after every filter
+    ranked = ranked_ids(products, match) if sort == 'relevance' and match else None
+    if ranked:
+        if project:
+            products = project(products, ())
+        return paginate_ranked(products, ranked, cursor, per_page), sort
+
+    if sort not in KEYSET_SORTS:
+        sort = 'newest'
+    if project:
+        products = project(products, (KEYSET_SORTS[sort][0],))
+    return paginate_keyset(products, sort, cursor, per_page), sort
+
+
+def _storefront_grid(store, query, category_id, sort, price, cursor=None):
+    """The grid's page plus the query string of the next one."""
+    page, sort = _storefront_page(store, query, category_id, sort, price, cursor)
+
+    next_query = None
+    if page.has_next:
+        params = {'sort': sort, 'cursor': page.next_cursor}
+        if query:
+            params['q'] = query
+        if category_id != 'all':
+            params['category'] = category_id
+        if price:
+            params['price'] = price
+        next_query = urlencode(params)
+
+    return {"products": page, "next_query": next_query}
+
+
+def _storefront_facets(store, query, category_id, price):
+    """Category counts and price histogram for the current search (core.facets)."""
+    match = _search_match(store, query)
+    return get_facets(
+        store, (query, category_id, price),
+        category_products=_storefront_products(store, query, match, price=price),
+        price_products=_storefront_products(store, query, match, category_id=category_id),
+    )
+
+
+def _grid_context(request, store, restart_on_bad_cursor):
+    """
+    Context for files/partials/product_grid.html. The page itself is loaded
+    lazily, so a cached grid fragment costs no product queries at all.
+    """
+    query, category_id, sort, price = _listing_params(request)
+    cursor = request.GET.get('cursor') or ''
+
+    def load_grid():
+        try:
+            return _storefront_grid(store, query, category_id, sort, price, cursor)
+        except InvalidCursor:
+            if not restart_on_bad_cursor:
+                raise
+            # stale or edited link: start again from the first page
+            return _storefront_grid(store, query, category_id, sort, price)
+
+    return {
         "store": store,
-        "products": paginated_products,
-        "categories": categories,
-        "active_announcements": active_announcements,  # ← This is correct now
-        "paginator": paginator,
         "query": query,
         "selected_category": category_id,
         "selected_sort": sort,
-        "liked_product_ids": liked_product_ids,
+        "selected_price": price,
+        "cursor": cursor,
+        "grid": SimpleLazyObject(load_grid),
+        "content_version": get_content_version(store.id),
+        "fragment_ttl": getattr(settings, 'STOREFRONT_FRAGMENT_TTL', 3600),
+    }
+
+
+def _public(response):
+    """Storefront HTML holds no per-visitor state, so shared caches may keep it for a while."""
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'STOREFRONT_PUBLIC_MAX_AGE', 60))
+    return response
+
+
+# Conditional GET: validators come only from the store's content version
+# (bumped by every catalog, announcement and Store change, core.signals),
+# which lives in the cache all workers share, so every worker computes the
+# same ones. A 304 costs no product queries and no template rendering.
+def _version_time(store):
+    version = get_content_version(store.id)
+    return version, datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+
+
+def _storefront_etag(request, *args, **kwargs):
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return None
+    version, _ = _version_time(store)
+    raw = f"{store.id}:{version}:{request.path}?{request.GET.urlencode()}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _storefront_last_modified(request, *args, **kwargs):
+    store = getattr(request, "subdomain_store", None)
+    return _version_time(store)[1] if store is not None else None
+
+
+def _product_etag(request, product_id):
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return None
+    row = (
+        Product.objects.filter(id=product_id, store=store, is_active=True)
+        .values_list('updated_at', 'like_count', 'comment_count').first()
+    )
+    if row is None:
+        return None
+    # likes and comments render live on the detail page, so their counters are part of the tag
+    version, _ = _version_time(store)
+    raw = f"{store.id}:{version}:{product_id}:{row[0].isoformat()}:{row[1]}:{row[2]}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+@condition(etag_func=_storefront_etag, last_modified_func=_storefront_last_modified)
+def storefront_view(request):
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return render(request, "files/store_not_found.html", status=404)
+
+    context = _grid_context(request, store, restart_on_bad_cursor=True)
+    query, category_id, price = context["query"], context["selected_category"], context["selected_price"]
+    context.update({
+        # lazy: only evaluated when their fragments miss the cache
+        "facets": SimpleLazyObject(lambda: _storefront_facets(store, query, category_id, price)),
+        "active_announcements": store.announcements.filter(is_active=True).order_by('-created_at'),
     })
+    return _public(render(request, "files/home.html", context))
+
+
+@condition(etag_func=_storefront_etag, last_modified_func=_storefront_last_modified)
+def storefront_products_fragment_view(request):
+    """HTMX endpoint: the next page of product cards for infinite scroll."""
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return HttpResponse(status=404)
+
+    context = _grid_context(request, store, restart_on_bad_cursor=False)
+    try:
+        return _public(render(request, "files/partials/product_grid.html", context))
+    except InvalidCursor:
+        return HttpResponse("Invalid cursor", status=400)
+
+
+LIKED_IDS_LIMIT = 100
+
+
+@never_cache
+@ensure_csrf_cookie
+def liked_products_view(request):
+    """
+    Which of ?ids=1,2,3 the visitor has liked. Storefront HTML is shared by
+    every visitor, so pages fetch their like state from here. Also hands
+    out the CSRF cookie the like/comment POSTs need.
+    """
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return JsonResponse({"error": "Store not found."}, status=404)
+
+    ids = [int(pk) for pk in request.GET.get('ids', '').split(',')[:LIKED_IDS_LIMIT] if _is_id(pk.strip())]
+    client_ip = get_client_ip(request)
+
+    liked = []
+    if ids and client_ip:
+        liked = list(
+            Like.objects.filter(user_ip=client_ip, product_id__in=ids, product__store=store)
+                        .values_list('product_id', flat=True)
+        )
+    return JsonResponse({"liked": liked})
 # ---------------------------
 # End Of STORE FRONTEND VIEW
 # ---------------------------
@@ -114,6 +296,7 @@ def storefront_view(request):
 # PRODUCT DETAIL VIEW
 #---------------------------
 
+@condition(etag_func=_product_etag)
 def storefront_product_detail_view(request, product_id):
     store = getattr(request, "subdomain_store", None)
 
@@ -121,45 +304,76 @@ def storefront_product_detail_view(request, product_id):
         return render(request, "files/store_not_found.html", status=404)
 
     product = get_object_or_404(
-        Product.objects.prefetch_related('images', 'comments', 'likes'), 
+        Product.objects.select_related('primary_image'),
         id=product_id, 
         store=store, 
         is_active=True
     )
     
-    # Calculate discount
-    product.calculate_discount()
+    primary_image = product.primary_image
     
-    # Get primary image
-    primary_image = product.images.filter(is_primary=True).first()
-    if not primary_image:
-        primary_image = product.images.first()
-    
-    # Get related products (same category)
+    # Related products: precomputed ranking (core.related), one indexed read
     related_products = Product.objects.filter(
-        categories__in=product.categories.all(),
-        store=store,
+        related_of__product=product,
         is_active=True
-    ).exclude(id=product.id).distinct()[:4]
+    ).order_by('related_of__rank').select_related('primary_image')[:4]
     
-    # Calculate discount for related products
-    for related_product in related_products:
-        related_product.calculate_discount()
-
-    # Check if current user has liked this product
-    client_ip = get_client_ip(request)
-    user_has_liked = False
-    if client_ip:
-        user_has_liked = product.likes.filter(user_ip=client_ip).exists()
-
-    return render(request, "files/product_detail.html", {
+    return _public(render(request, "files/product_detail.html", {
         "store": store,
         "product": product,
         "primary_image": primary_image,
         "related_products": related_products,
-        "user_has_liked": user_has_liked,
-        "whatsapp_link": store.get_whatsapp_link(product.title)
-    })
+        "whatsapp_link": store.get_whatsapp_link(product.title),
+        "content_version": get_content_version(store.id),
+        "fragment_ttl": getattr(settings, 'STOREFRONT_FRAGMENT_TTL', 3600),
+    }))
+
+
+def product_image_view(request, image_id, width):
+    """
+    A product image at least `width` px wide (when there is one) in the best
+    format the browser's Accept header allows (core.renditions.pick). For
+    clients that can't use <picture>: CSS backgrounds, API consumers, e-mail.
+    """
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return HttpResponse(status=404)
+
+    image = get_object_or_404(
+        ProductImage.objects.only('id', 'image', 'renditions'),
+        pk=image_id, product__store=store, product__is_active=True,
+    )
+    choice = pick(image.renditions or {}, request.headers.get('Accept', ''), width)
+    if choice is not None:
+        content_type, name = choice[0].mime, choice[1]
+    else:  # derivatives not rendered yet
+        name = image.image.name
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    etag = f'"{hashlib.md5(name.encode()).hexdigest()}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            response = FileResponse(image.image.storage.open(name, 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            raise Http404("Image file is missing.")
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'PRODUCT_IMAGE_MAX_AGE', 86400))
+    return response
+
+
+def image_resize_view(request, kind, pk, width, signature, extension):
+    """Signed on-demand resize (core.image_cache); URLs change with the source, so responses are immutable."""
+    try:
+        source, fmt = image_cache.resolve(kind, pk, width, signature, extension)
+        file = image_cache.open_resized(source, width, fmt)
+    except image_cache.InvalidResize:
+        raise Http404("No such image.")
+
+    response = FileResponse(file, content_type=fmt.mime)
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
 
 # ---------------------------
 # End Of PRODUCT DETAIL VIEW
@@ -175,27 +389,16 @@ def like_product_view(request, product_id):
     if store is None:
         return JsonResponse({"error": "Store not found."}, status=404)
 
-    product = get_object_or_404(Product, id=product_id, store=store, is_active=True)
+    product = get_object_or_404(
+        Product.objects.only('id', 'like_count'), id=product_id, store=store, is_active=True
+    )
     client_ip = get_client_ip(request)
 
     # Validate IP address
     if not client_ip:
         return JsonResponse({"error": "Could not determine IP address."}, status=400)
 
-    existing_like = Like.objects.filter(product=product, user_ip=client_ip).first()
-
-    if existing_like:
-        existing_like.delete()
-        liked = False
-    else:
-        try:
-            Like.objects.create(product=product, user_ip=client_ip)
-            liked = True
-        except IntegrityError:
-            # In case of race condition on unique_together
-            liked = True
-
-    like_count = product.likes.count()
+    liked, like_count = toggle_like(product, client_ip)
 
     return JsonResponse({
         "liked": liked,
@@ -226,7 +429,8 @@ def add_comment_view(request, product_id):
         text=comment_text
     )
 
-    comment_count = product.comments.count()
+    product.refresh_from_db(fields=['comment_count'])
+    comment_count = product.comment_count
 
     return JsonResponse({
         "success": True,
@@ -243,6 +447,131 @@ def add_comment_view(request, product_id):
 #------------------------
 
 
+#---------------------------
+# STOREFRONT JSON API (v1)
+#---------------------------
+# Read-only and template-free. Product endpoints take ?fields= (core.api);
+# ETags reuse the storefront's content-version validators, except for
+# responses carrying live counters, which are tagged by their body.
+
+API_MAX_PAGE_SIZE = 50
+API_BATCH_LIMIT = 100
+
+
+def _api_fields(request):
+    return api.parse_fields(request.GET.get('fields', ''))
+
+
+def _valid_api_category(request):
+    category = request.GET.get('category', 'all')
+    return category == 'all' or _is_id(category)
+
+
+def _api_etag(request, *args, **kwargs):
+    try:
+        live = api.LIVE_FIELDS.intersection(_api_fields(request))
+    except api.InvalidFields:
+        return None
+    if live or not _valid_api_category(request):
+        return None
+    return _storefront_etag(request)
+
+
+def _api_error(request, message, status):
+    return api.json_response(request, {"error": message}, status=status)
+
+
+def _api_products_response(request, data, fields):
+    return _public(api.json_response(request, data, tag_body=bool(api.LIVE_FIELDS.intersection(fields))))
+
+
+@condition(etag_func=_api_etag)
+def api_products_view(request):
+    """Product listing: same filters and sorts as the storefront grid, keyset-paginated."""
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return _api_error(request, "Store not found.", 404)
+
+    try:
+        fields = _api_fields(request)
+    except api.InvalidFields as exc:
+        return _api_error(request, str(exc), 400)
+
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), API_MAX_PAGE_SIZE) if _is_id(limit) and int(limit) > 0 else STOREFRONT_PAGE_SIZE
+
+    if not _valid_api_category(request):
+        return _api_error(request, "Invalid category.", 400)
+
+    query, category_id, sort, price = _listing_params(request)
+    try:
+        page, sort = _storefront_page(
+            store, query, category_id, sort, price, request.GET.get('cursor') or None, limit,
+            project=lambda products, columns: api.project(products, fields, columns),
+        )
+    except InvalidCursor:
+        return _api_error(request, "Invalid cursor.", 400)
+
+    return _api_products_response(request, {
+        "results": [api.serialize(product, fields) for product in page],
+        "sort": sort,
+        "next_cursor": page.next_cursor,
+    }, fields)
+
+
+@condition(etag_func=_api_etag)
+def api_products_batch_view(request):
+    """Products by ?ids=1,2,3 in the order asked; unknown or inactive ids are left out."""
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return _api_error(request, "Store not found.", 404)
+
+    try:
+        fields = _api_fields(request)
+    except api.InvalidFields as exc:
+        return _api_error(request, str(exc), 400)
+
+    ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if _is_id(pk.strip())]
+    if len(ids) > API_BATCH_LIMIT:
+        return _api_error(request, f"At most {API_BATCH_LIMIT} ids per request.", 400)
+
+    products = api.project(store.products.filter(is_active=True, id__in=ids), fields)
+    by_id = {product.id: product for product in products} if ids else {}
+    return _api_products_response(request, {
+        "results": [api.serialize(by_id[pk], fields) for pk in dict.fromkeys(ids) if pk in by_id],
+    }, fields)
+
+
+@condition(etag_func=_storefront_etag, last_modified_func=_storefront_last_modified)
+def api_categories_view(request):
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return _api_error(request, "Store not found.", 404)
+
+    categories = (
+        store.categories.annotate(product_count=Count('products', filter=Q(products__is_active=True)))
+        .order_by('name').values('id', 'name', 'product_count')
+    )
+    return _public(api.json_response(request, {"results": list(categories)}))
+
+
+@condition(etag_func=_storefront_etag, last_modified_func=_storefront_last_modified)
+def api_announcements_view(request):
+    store = getattr(request, "subdomain_store", None)
+    if store is None:
+        return _api_error(request, "Store not found.", 404)
+
+    announcements = (
+        store.announcements.filter(is_active=True).order_by('-created_at')
+        .values('id', 'title', 'message', 'created_at')
+    )
+    return _public(api.json_response(request, {"results": list(announcements)}))
+
+#---------------------------
+# End of STOREFRONT JSON API
+#---------------------------
+
+
 # ---------------------------
 # SIGNUP VIEW
 # ---------------------------
@@ -455,9 +784,14 @@ def shop_manager_dashboard_view(request):
         "low_stock": products.filter(available_stock__lte=3, available_stock__gt=0).count(),
     }
 
-    recent_products = products.order_by('-created_at')[:3]
+    recent_products = products.select_related('primary_image').order_by('-created_at')[:3]
     category_count = categories.count()
 
+    # ---------------------------------------------------------
+    # TRAFFIC (pre-aggregated by `manage.py rollup_visitors`)
+    # ---------------------------------------------------------
+    traffic = store_traffic(store.id)
+
     # ---------------------------------------------------------
     # ANNOUNCEMENTS
     # ---------------------------------------------------------
@@ -569,6 +903,7 @@ def shop_manager_dashboard_view(request):
         "global_announcements": global_announcements,
         "announcements_page_obj": announcements_page_obj,
         "absolute_url": absolute_url,
+        "traffic": traffic,
     }
 
     return render(request, 'files/shop_manager_dashboard.html', context)
@@ -737,8 +1072,6 @@ def product_management_view(request):
             about_3=about_3,
             about_4=about_4
         )
-        product.calculate_discount()
-        product.save()
 
         # assign categories
         if category_ids:
@@ -769,7 +1102,6 @@ def product_management_view(request):
         product.about_3 = request.POST.get("about_3")
         product.about_4 = request.POST.get("about_4")
 
-        product.calculate_discount()
         product.save()
 
         # update categories
@@ -816,7 +1148,9 @@ def product_management_view(request):
     # -----------------------------
     # PAGINATION
     # -----------------------------
-    paginator = Paginator(product_qs, 7)  # 10 per page
+    paginator = Paginator(
+        product_qs.select_related('primary_image').prefetch_related('images', 'categories'), 7
+    )  # 10 per page
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
 
@@ -0,0 +1,31 @@
+
+from django.conf import settings
+
+from .interning import encode_visits
+from .models import Visitor
+from .write_buffer import BufferedWriter
+
+
+def _write_visits(visits):
+    encode_visits(visits)
+    Visitor.objects.bulk_create(visits, batch_size=getattr(settings, "VISITOR_LOG_BATCH_SIZE", 200))
+
+
+def get_writer():
+    """Return the process-wide visit buffer, creating it on first use."""
+    return BufferedWriter.singleton("visitor-log", _write_visits, "VISITOR_LOG", batch_size=200)
+
+
+def log_visit(**fields):
+    """
+    Record a page view.
+    - VISITOR_LOG_MODE = "buffered" → queued and bulk inserted in the background.
+    - VISITOR_LOG_MODE = "sync" → inserted immediately on the request thread.
+    """
+    visit = Visitor(**fields)
+
+    if getattr(settings, "VISITOR_LOG_MODE", "buffered") == "buffered":
+        get_writer().put(visit)
+    else:
+        encode_visits([visit])
+        visit.save()
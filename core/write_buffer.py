@@ -0,0 +1,159 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+_writers = {}  # name → process-wide BufferedWriter (see BufferedWriter.singleton)
+_writers_lock = threading.Lock()
+
+
+class BufferedWriter:
+    """
+    In-process write-behind buffer.
+
+    Request threads call put() which only enqueues the item. A daemon
+    thread drains the queue and hands batches of up to `batch_size`
+    items to `flush_func`, at least every `flush_interval` seconds.
+    Whatever is still queued at interpreter exit is flushed by close().
+    """
+
+    def __init__(self, flush_func, batch_size=100, flush_interval=2.0,
+                 max_queue_size=10000, name="buffered-writer"):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._atexit_registered = False
+
+    @classmethod
+    def singleton(cls, name, flush_func, setting_prefix, batch_size=100, flush_interval=2.0, max_queue_size=10000):
+        """
+        The process-wide writer called `name`, created on first use. Settings
+        <setting_prefix>_BATCH_SIZE, _FLUSH_INTERVAL and _MAX_QUEUE override
+        the defaults given here.
+        """
+        with _writers_lock:
+            writer = _writers.get(name)
+            if writer is None:
+                writer = _writers[name] = cls(
+                    flush_func,
+                    batch_size=getattr(settings, f"{setting_prefix}_BATCH_SIZE", batch_size),
+                    flush_interval=getattr(settings, f"{setting_prefix}_FLUSH_INTERVAL", flush_interval),
+                    max_queue_size=getattr(settings, f"{setting_prefix}_MAX_QUEUE", max_queue_size),
+                    name=name,
+                )
+        return writer
+
+    # -------------------------
+    # Producer side
+    # -------------------------
+    def put(self, item):
+        """Queue an item for writing. Returns False if it was dropped."""
+        if self._closed:
+            self.flush_func([item])
+            return True
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            logger.warning("%s queue full, dropping item.", self.name)
+            return False
+
+    def flush(self):
+        """Synchronously write everything currently queued."""
+        while True:
+            batch = self._take_batch(timeout=0)
+            if not batch:
+                return
+            batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=10):
+        """Stop the background thread and flush the remaining items."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+
+        self.flush()
+
+    # -------------------------
+    # Consumer side
+    # -------------------------
+    def _ensure_started(self):
+        # Also covers a thread that vanished because the process forked.
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._closed or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._take_batch(timeout=self.flush_interval)
+                stop = bool(batch) and batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._write(batch)
+                if stop:
+                    return
+        finally:
+            connections.close_all()
+
+    def _take_batch(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            try:
+                if timeout:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            self.flush_func(batch)
+        except Exception:
+            logger.exception("%s failed to write %d item(s).", self.name, len(batch))